@@ -1,55 +1,50 @@
 # agent.py
-from typing import List
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional
 from langchain_google_genai import ChatGoogleGenerativeAI
 import os
-from state import chat_sessions, feedback_store
-from utils import search_similar  # your semantic search
+from fastapi.concurrency import run_in_threadpool
+from state import session_store
+from utils import search_rows, encode_query  # your semantic search
+from response_cache import ResponseCache
+from context_builder import build_context, prompt_usage
+import async_db
+import retrieval
 from dotenv import load_dotenv
 
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = os.getenv("CHAT_MODEL", "gemini-2.5-pro")
-MAX_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", 400))
+CHAT_LLM = os.getenv("CHAT_LLM", "gemini")  # "gemini" or "fake" (offline, see fake_llm.py)
 TOP_K = 5
 
 # Initialize Gemini LLM
-chat_llm = ChatGoogleGenerativeAI(model=MODEL_NAME, google_api_key=GEMINI_API_KEY)
+if CHAT_LLM == "fake":
+    from fake_llm import fake_chat_llm
+    chat_llm = fake_chat_llm()
+else:
+    chat_llm = ChatGoogleGenerativeAI(model=MODEL_NAME, google_api_key=GEMINI_API_KEY)
 
 
-def adjust_with_feedback(session_id: str, chunks: List[str]) -> List[str]:
-    penalized = feedback_store.get(session_id, {})
-    return [c for i, c in enumerate(chunks) if penalized.get(i) != -1]
-
+# Near-duplicate questions over the same chunks reuse an earlier answer
+response_cache = ResponseCache()
 
-def save_message(session_id: str, role: str, content: str):
-    if session_id not in chat_sessions:
-        chat_sessions[session_id] = []
-    chat_sessions[session_id].append({"role": role, "content": content})
 
-
-def get_history(session_id: str, limit: int = 5) -> List[str]:
-    history = chat_sessions.get(session_id, [])
-    return [f"{m['role']}: {m['content']}" for m in history[-limit:]]
+def adjust_with_feedback(session_id: str, chunks: list) -> list:
+    penalized = session_store.feedback(session_id)
+    return [c for i, c in enumerate(chunks) if penalized.get(i) != -1]
 
 
-def ask_agent(session_id: str, query: str) -> str:
-    # 1️⃣ Semantic search
-    chunks = search_similar(query)[:TOP_K]
-    chunks = adjust_with_feedback(session_id, chunks)
-    if not chunks:
-        return "Sorry — I don't have enough information in my database to answer that. Please consult a professional if needed."
+def save_message(session_id: str, role: str, content: str):
+    session_store.append(session_id, role, content)
 
-    # 2️⃣ Retrieve last few messages
-    history_text = "\n".join(get_history(session_id, limit=5))
 
-    # 3️⃣ Build context (truncate if too long)
-    context = "\n".join(chunks)
-    if len(context) > MAX_CHARS:
-        context = context[:MAX_CHARS]
+NO_INFO_REPLY = "Sorry — I don't have enough information in my database to answer that. Please consult a professional if needed."
+ERROR_REPLY = "Sorry, I am unable to generate a response right now. Please try again later."
 
-    # 4️⃣ Build prompt
-    prompt = f"""
+PROMPT_TEMPLATE = """
 You are a compassionate mental health assistant for parents of children with developmental or mental disabilities.
 Use the context below (from trusted resources) and the chat history to answer concisely, empathetically, and safely.
 Do NOT provide medical diagnosis or prescribe treatment — always recommend professional consultation.
@@ -58,7 +53,7 @@ Context:
 {context}
 
 Chat History:
-{history_text}
+{history}
 
 User Question:
 {query}
@@ -66,15 +61,155 @@ User Question:
 Answer concisely in 2-4 sentences:
 """
 
-    try:
-        response = chat_llm.invoke(prompt)
-        reply = response.content if hasattr(response, "content") else str(response)
 
-        # 5️⃣ Save user + assistant messages to session
+def build_prompt(session_id: str, query: str, chunks: List[str]) -> str:
+    # 2️⃣ + 3️⃣ Fit ranked chunks, rolling summary and recent messages into the token budget
+    summary, summarized = session_store.summary(session_id)
+    built = build_context(
+        chunks, session_store.messages(session_id), summary, summarized,
+        fixed_text=PROMPT_TEMPLATE.format(context="", history="", query=query),
+    )
+    session_store.set_summary(session_id, built.summary, built.summarized)
+    prompt_usage.record(built.usage)
+
+    history = built.history
+    if built.summary:
+        history = f"Earlier in this conversation:\n{built.summary}\n\nRecent messages:\n{history}"
+
+    # 4️⃣ Build prompt
+    return PROMPT_TEMPLATE.format(context=built.context, history=history, query=query)
+
+
+def _finish(session_id: str, query: str, response) -> str:
+    reply = response.content if hasattr(response, "content") else str(response)
+
+    # 5️⃣ Save user + assistant messages to session
+    save_message(session_id, "user", query)
+    save_message(session_id, "assistant", reply)
+
+    return reply
+
+
+async def _load_session(session_id: str):
+    # loading (or re-validating) a session is a blocking query, keep it off the event loop
+    if session_store.needs_load(session_id):
+        await run_in_threadpool(session_store.ensure_loaded, session_id)
+
+
+def _cacheable(session_id: str) -> bool:
+    """Whether this request may use and feed the response cache; decided once, before the reply is saved."""
+    return response_cache.applies(session_store.history_len(session_id))
+
+
+def _cached_reply(session_id: str, query: str, query_vector, chunk_ids) -> Optional[str]:
+    """Reuse an answer to a near-identical earlier question (call only when _cacheable)."""
+    reply = response_cache.lookup(query_vector, chunk_ids)
+    if reply is not None:
         save_message(session_id, "user", query)
         save_message(session_id, "assistant", reply)
+    return reply
 
+
+def ask_agent(session_id: str, query: str) -> str:
+    """Blocking version, kept for scripts and sync callers."""
+    # 1️⃣ Semantic search
+    rows = adjust_with_feedback(session_id, search_rows(query)[:TOP_K])
+    if not rows:
+        return NO_INFO_REPLY
+    chunk_ids = [row[0] for row in rows]
+    query_vector = encode_query(query)
+    cacheable = _cacheable(session_id)
+    cached = _cached_reply(session_id, query, query_vector, chunk_ids) if cacheable else None
+    if cached is not None:
+        return cached
+
+    prompt = build_prompt(session_id, query, [row[1] for row in rows])
+    try:
+        start = time.perf_counter()
+        reply = _finish(session_id, query, chat_llm.invoke(prompt))
+        if cacheable:
+            response_cache.store(query_vector, chunk_ids, reply, time.perf_counter() - start)
+        return reply
+    except Exception as e:
+        print(f"❌ ERROR calling Gemini LLM: {e}")
+        return ERROR_REPLY
+
+
+async def ask_agent_async(session_id: str, query: str, timings: dict = None) -> str:
+    """
+    Same as ask_agent, but awaits Postgres and Gemini instead of blocking a thread.
+    If `timings` is given, "retrieve" (with its retrieve_* stages) and "llm" durations (seconds)
+    are written into it.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    await _load_session(session_id)
+    # 1️⃣ Hybrid search (BM25 + vectors, see retrieval.py)
+    rows = adjust_with_feedback(session_id, (await retrieval.search_rows(query, timings))[:TOP_K])
+    if not rows:
+        timings["retrieve"] = time.perf_counter() - start
+        return NO_INFO_REPLY
+    chunk_ids = [row[0] for row in rows]
+    query_vector = await async_db.encode_query(query)
+    timings["retrieve"] = time.perf_counter() - start
+    cacheable = _cacheable(session_id)
+    cached = _cached_reply(session_id, query, query_vector, chunk_ids) if cacheable else None
+    if cached is not None:
+        return cached
+
+    prompt = build_prompt(session_id, query, [row[1] for row in rows])
+    try:
+        start = time.perf_counter()
+        reply = _finish(session_id, query, await chat_llm.ainvoke(prompt))
+        timings["llm"] = time.perf_counter() - start
+        if cacheable:
+            response_cache.store(query_vector, chunk_ids, reply, timings["llm"])
         return reply
     except Exception as e:
         print(f"❌ ERROR calling Gemini LLM: {e}")
-        return "Sorry, I am unable to generate a response right now. Please try again later."
+        return ERROR_REPLY
+
+
+async def stream_agent(session_id: str, query: str) -> AsyncIterator[str]:
+    """
+    Streaming version of ask_agent_async: yields reply text as the LLM produces it.
+    The exchange is saved to the session only once the stream completes; if the
+    consumer stops early (client disconnect), the upstream call is cancelled and
+    nothing is saved.
+    """
+    await _load_session(session_id)
+    # 1️⃣ Hybrid search (BM25 + vectors, see retrieval.py)
+    rows = adjust_with_feedback(session_id, (await retrieval.search_rows(query))[:TOP_K])
+    if not rows:
+        yield NO_INFO_REPLY
+        return
+    chunk_ids = [row[0] for row in rows]
+    query_vector = await async_db.encode_query(query)
+    cacheable = _cacheable(session_id)
+    cached = _cached_reply(session_id, query, query_vector, chunk_ids) if cacheable else None
+    if cached is not None:
+        yield cached
+        return
+
+    prompt = build_prompt(session_id, query, [row[1] for row in rows])
+    parts = []
+    start = time.perf_counter()
+    try:
+        # closed (and the upstream request cancelled) as soon as our consumer stops
+        async with aclosing(chat_llm.astream(prompt)) as pieces:
+            async for piece in pieces:
+                text = piece.content if hasattr(piece, "content") else str(piece)
+                if text:
+                    parts.append(text)
+                    yield text
+    except Exception as e:
+        print(f"❌ ERROR streaming from Gemini LLM: {e}")
+        yield ERROR_REPLY
+        return
+
+    # 5️⃣ Save user + assistant messages to session
+    reply = "".join(parts)
+    save_message(session_id, "user", query)
+    save_message(session_id, "assistant", reply)
+    if cacheable:
+        response_cache.store(query_vector, chunk_ids, reply, time.perf_counter() - start)
@@ -0,0 +1,292 @@
+# ann_index.py
+# Optional in-memory approximate nearest-neighbour index over mental_health_embeddings.
+#
+# IVF (inverted file) over a NumPy float32 matrix: vectors are bucketed around
+# k-means centroids and a query only scans the `nprobe` closest buckets.
+# Distances match the SQL path (db.VECTOR_METRIC): "l2" → embedding <-> q,
+# "cosine" → embedding <=> q.
+#
+# Enabled with VECTOR_SEARCH_BACKEND=ann. Loaded once at startup and kept in
+# sync with the table by a background refresh thread (new rows are appended,
+# deletions trigger a rebuild).
+#
+# python ann_index.py --recall 200 --k 5   → recall@k of the index vs. an exact scan
+
+import argparse
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from db import get_connection, VECTOR_METRIC
+
+ANN_NLIST = int(os.getenv("ANN_NLIST", 0))          # number of IVF buckets (0 = sqrt(N))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", 8))        # buckets scanned per query
+ANN_MIN_TRAIN = int(os.getenv("ANN_MIN_TRAIN", 2000))  # below this many rows, just scan everything
+ANN_REFRESH_SECONDS = float(os.getenv("ANN_REFRESH_SECONDS", 60))
+KMEANS_ITERATIONS = 10
+
+
+class IVFIndex:
+    """
+    IVF index with an exact fallback for small collections.
+    search() works on an immutable snapshot, so add()/build() can run concurrently.
+    """
+
+    def __init__(self, metric: str = VECTOR_METRIC, nlist: int = ANN_NLIST, nprobe: int = ANN_NPROBE):
+        if metric not in ("l2", "cosine"):
+            raise ValueError(f"unsupported metric: {metric}")
+        self.metric = metric
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot.empty()
+        self._trained_size = 0
+
+    def __len__(self):
+        return len(self._snapshot.ids)
+
+    @property
+    def max_id(self) -> int:
+        ids = self._snapshot.ids
+        return int(ids.max()) if len(ids) else 0
+
+    def build(self, ids, vectors, contents: List[str]):
+        vectors = self._prepare(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+        centroids, assignments = self._train(vectors)
+        with self._lock:
+            self._snapshot = _Snapshot(ids, vectors, list(contents), centroids, assignments)
+            self._trained_size = len(ids)
+
+    def add(self, ids, vectors, contents: List[str]):
+        """Append rows without retraining (until the collection doubles)."""
+        if len(ids) == 0:
+            return
+        vectors = self._prepare(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            snap = self._snapshot
+            all_ids = np.concatenate([snap.ids, ids])
+            all_vectors = np.vstack([snap.vectors, vectors])
+            all_contents = snap.contents + list(contents)
+            needs_retrain = len(all_ids) > 2 * max(self._trained_size, ANN_MIN_TRAIN // 2)
+        if needs_retrain:
+            self.build(all_ids, all_vectors, all_contents)
+            return
+        with self._lock:
+            assignments = None
+            if snap.centroids is not None:
+                assignments = np.concatenate([snap.assignments, self._assign(vectors, snap.centroids)])
+            self._snapshot = _Snapshot(all_ids, all_vectors, all_contents, snap.centroids, assignments)
+
+    def search(self, query_vector, k: int) -> List[Tuple[int, str, float]]:
+        """Top-k as (id, content, distance), nearest first."""
+        snap = self._snapshot
+        if not len(snap.ids):
+            return []
+        q = self._prepare(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+
+        if snap.centroids is None:
+            candidates = None
+        else:
+            probe = _top_k(self._distances(snap.centroids, q), min(self.nprobe, len(snap.centroids)))
+            candidates = np.flatnonzero(np.isin(snap.assignments, probe))
+
+        vectors = snap.vectors if candidates is None else snap.vectors[candidates]
+        dists = self._distances(vectors, q)
+        best = _top_k(dists, min(k, len(dists)))
+        rows = best if candidates is None else candidates[best]
+        return [(int(snap.ids[r]), snap.contents[r], float(d)) for r, d in zip(rows, dists[best])]
+
+    def exact_search(self, query_vector, k: int) -> List[Tuple[int, str, float]]:
+        """Brute-force scan over every row (ground truth for recall checks)."""
+        snap = self._snapshot
+        q = self._prepare(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        dists = self._distances(snap.vectors, q)
+        best = _top_k(dists, min(k, len(dists)))
+        return [(int(snap.ids[r]), snap.contents[r], float(dists[r])) for r in best]
+
+    # ---------------- internals ----------------
+    def _prepare(self, vectors) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    def _distances(self, vectors: np.ndarray, q: np.ndarray) -> np.ndarray:
+        if self.metric == "cosine":
+            return 1.0 - vectors @ q
+        diff = vectors - q
+        return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+    def _assign(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        if self.metric == "cosine":
+            return np.argmax(vectors @ centroids.T, axis=1)
+        # ||x - c||^2 = ||x||^2 - 2 x·c + ||c||^2 ; ||x||^2 doesn't change the argmin
+        scores = (centroids ** 2).sum(axis=1) - 2.0 * (vectors @ centroids.T)
+        return np.argmin(scores, axis=1)
+
+    def _train(self, vectors: np.ndarray):
+        n = len(vectors)
+        if n < ANN_MIN_TRAIN:
+            return None, None
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(n, size=min(n, nlist * 256), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            labels = self._assign(sample, centroids)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            if self.metric == "cosine":
+                centroids = self._prepare(centroids)
+        return centroids, self._assign(vectors, centroids)
+
+
+class _Snapshot:
+    def __init__(self, ids, vectors, contents, centroids, assignments):
+        self.ids = ids
+        self.vectors = vectors
+        self.contents = contents
+        self.centroids = centroids
+        self.assignments = assignments
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), np.empty((0, 384), dtype=np.float32), [], None, None)
+
+
+def _top_k(dists: np.ndarray, k: int) -> np.ndarray:
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(dists):
+        part = np.argpartition(dists, k - 1)[:k]
+    else:
+        part = np.arange(len(dists))
+    return part[np.argsort(dists[part])]
+
+
+# ---------------- loading from Postgres ----------------
+_index: Optional[IVFIndex] = None
+_row_count = 0
+_refresher: Optional[threading.Thread] = None
+
+
+def _fetch_rows(after_id: int = 0):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, content, embedding::real[]
+            FROM mental_health_embeddings
+            WHERE id > %s
+            ORDER BY id
+        """, (after_id,))
+        rows = cur.fetchall()
+    if not rows:
+        return [], np.empty((0, 384), dtype=np.float32), []
+    ids, contents, vectors = zip(*rows)
+    return list(ids), np.asarray(vectors, dtype=np.float32), list(contents)
+
+
+def _table_size() -> int:
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM mental_health_embeddings")
+        return cur.fetchone()[0]
+
+
+def load() -> IVFIndex:
+    """(Re)build the index from the embeddings table."""
+    global _index, _row_count
+    start = time.perf_counter()
+    ids, vectors, contents = _fetch_rows()
+    index = IVFIndex()
+    index.build(ids, vectors, contents)
+    _index, _row_count = index, len(ids)
+    print(f"✅ ANN index loaded: {len(ids)} vectors in {time.perf_counter() - start:.1f}s")
+    return index
+
+
+def refresh():
+    """Append rows added since the last load; rebuild if rows were deleted."""
+    global _row_count
+    if _index is None:
+        load()
+        return
+    ids, vectors, contents = _fetch_rows(after_id=_index.max_id)
+    _index.add(ids, vectors, contents)
+    _row_count += len(ids)
+    if _table_size() != _row_count:
+        load()
+
+
+def _refresh_loop():
+    while True:
+        time.sleep(ANN_REFRESH_SECONDS)
+        try:
+            refresh()
+        except Exception as e:
+            print(f"❌ ANN index refresh failed: {e}")
+
+
+def start_background_refresh():
+    global _refresher
+    if _refresher is None and ANN_REFRESH_SECONDS > 0:
+        _refresher = threading.Thread(target=_refresh_loop, name="ann-refresh", daemon=True)
+        _refresher.start()
+
+
+def is_loaded() -> bool:
+    return _index is not None
+
+
+def get_index() -> IVFIndex:
+    return _index if _index is not None else load()
+
+
+def search(query_vector, k: int) -> List[Tuple[int, str, float]]:
+    return get_index().search(query_vector, k)
+
+
+def recall_at_k(queries: np.ndarray, k: int) -> dict:
+    """Compare the index against an exact scan for a batch of query vectors."""
+    index = get_index()
+    hits, ann_time, exact_time = 0, 0.0, 0.0
+    for q in queries:
+        t0 = time.perf_counter()
+        approx = {row[0] for row in index.search(q, k)}
+        t1 = time.perf_counter()
+        exact = {row[0] for row in index.exact_search(q, k)}
+        t2 = time.perf_counter()
+        hits += len(approx & exact)
+        ann_time += t1 - t0
+        exact_time += t2 - t1
+    n = max(len(queries), 1)
+    return {
+        "queries": len(queries),
+        "k": k,
+        "recall": hits / (n * k),
+        "ann_avg_us": ann_time / n * 1e6,
+        "exact_avg_us": exact_time / n * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-memory ANN index over mental_health_embeddings")
+    parser.add_argument("--recall", type=int, default=100, help="number of stored vectors to use as queries")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    index = load()
+    snap = index._snapshot
+    rng = np.random.default_rng(0)
+    sample = snap.vectors[rng.choice(len(snap.vectors), size=min(args.recall, len(snap.vectors)), replace=False)]
+    # perturb the stored vectors a little so queries don't trivially hit themselves
+    queries = sample + rng.normal(scale=0.01, size=sample.shape).astype(np.float32)
+    report = recall_at_k(queries, args.k)
+    print(f"recall@{args.k}: {report['recall']:.3f} over {report['queries']} queries "
+          f"(ann {report['ann_avg_us']:.0f}µs vs exact {report['exact_avg_us']:.0f}µs per query)")
@@ -11,12 +11,12 @@ from pydantic import BaseModel
 from utils import search_similar  # must return a list of chunks (strings)
 # NOTE: we don't import the Chat code from agent.py here; we'll instantiate it when needed
 from langchain_google_genai import ChatGoogleGenerativeAI
+from context_builder import build_context
 
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = os.getenv("CHAT_MODEL", "gemini-2.5-pro")
-MAX_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", 400))
 
 app = FastAPI()
 
@@ -35,6 +35,23 @@ app.add_middleware(
 
 # in-memory session store: session_id -> list of dicts [{'role': 'User'/'Assistant', 'content': '...'}]
 sessions = {}
+# rolling summary of older turns per session: session_id -> (summary, messages covered)
+summaries = {}
+
+PROMPT_TEMPLATE = """
+You are a compassionate support assistant for parents of children with developmental or mental disabilities.
+Use the context below (from trusted resources) and the conversation history to answer concisely, empathetically and safely.
+Do NOT provide a medical diagnosis or prescribe treatment — always recommend professional consultation for serious issues.
+
+Context:
+{context}
+
+Conversation:
+{history}
+User: {query}
+
+Assistant (answer concisely in 2-4 sentences):
+"""
 
 class ChatRequest(BaseModel):
     query: str
@@ -55,6 +72,7 @@ def new_session():
 def clear_session(session_id: str):
     if session_id in sessions:
         sessions[session_id] = []
+        summaries.pop(session_id, None)
         return {"ok": True}
     else:
         raise HTTPException(status_code=404, detail="session not found")
@@ -80,35 +98,19 @@ def chat_endpoint(req: ChatRequest):
         sessions[sid].append({"role": "Assistant", "content": reply})
         return ChatResponse(reply=reply, session_id=sid, from_db=False)
 
-    # 2) Build context
-    context = "\n".join(chunks)
-    if len(context) > MAX_CHARS:
-        context = context[:MAX_CHARS]
-
-    # 3) build a readable conversation history
-    history_lines = []
-    for turn in sessions[sid]:
-        role = turn.get("role", "User")
-        content = turn.get("content", "")
-        history_lines.append(f"{role}: {content}")
-    # include current user query in history_text as "User: ..."
-    history_lines.append(f"User: {query}")
-    history_text = "\n".join(history_lines)
+    # 2) + 3) Fit ranked chunks, a rolling summary and the recent turns into the token budget
+    summary, summarized = summaries.get(sid, ("", 0))
+    built = build_context(
+        chunks, sessions[sid], summary, summarized,
+        fixed_text=PROMPT_TEMPLATE.format(context="", history="", query=query),
+    )
+    summaries[sid] = (built.summary, built.summarized)
+    history_text = built.history
+    if built.summary:
+        history_text = f"Earlier in this conversation:\n{built.summary}\n\n{history_text}"
 
     # 4) prompt template (empathetic, concise)
-    prompt = f"""
-You are a compassionate support assistant for parents of children with developmental or mental disabilities.
-Use the context below (from trusted resources) and the conversation history to answer concisely, empathetically and safely.
-Do NOT provide a medical diagnosis or prescribe treatment — always recommend professional consultation for serious issues.
-
-Context:
-{context}
-
-Conversation:
-{history_text}
-
-Assistant (answer concisely in 2-4 sentences):
-"""
+    prompt = PROMPT_TEMPLATE.format(context=built.context, history=history_text, query=query)
 
     # 5) Call Gemini chat
     chat = ChatGoogleGenerativeAI(model=MODEL_NAME, google_api_key=GEMINI_API_KEY)
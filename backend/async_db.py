@@ -0,0 +1,225 @@
+# async_db.py
+# asyncio-native data access (asyncpg) for the FastAPI routes.
+# Same tables and queries as db.py / utils.py, but awaiting Postgres instead of
+# holding a threadpool worker. The sync versions stay for the CLI scripts.
+import os
+import struct
+from typing import AsyncIterator, List, Optional
+
+import asyncpg
+import numpy as np
+
+from db import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, TOP_K_SQL, search_settings
+from utils import embedding_batcher, query_cache, TOP_K, VECTOR_SEARCH_BACKEND, EMBEDDINGS_VERSION_SQL
+from query_cache import normalize_query
+import ann_index
+
+ASYNC_DB_POOL_MIN = int(os.getenv("ASYNC_DB_POOL_MIN", 2))
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", 20))
+
+_pool: Optional[asyncpg.Pool] = None
+
+
+# pgvector binary wire format: uint16 dim, uint16 unused, dim x big-endian float32
+def _encode_vector(value) -> bytes:
+    vec = np.asarray(value, dtype=">f4")
+    return struct.pack(">HH", len(vec), 0) + vec.tobytes()
+
+
+def _decode_vector(data: bytes) -> np.ndarray:
+    dim, _ = struct.unpack_from(">HH", data)
+    return np.frombuffer(data, dtype=">f4", count=dim, offset=4).astype(np.float32)
+
+
+async def _init_connection(conn):
+    # pgvector type is not built into asyncpg; send/receive it in binary
+    await conn.set_type_codec(
+        "vector", schema="public", format="binary",
+        encoder=_encode_vector, decoder=_decode_vector,
+    )
+
+
+async def init_pool():
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            database=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT,
+            min_size=ASYNC_DB_POOL_MIN,
+            max_size=ASYNC_DB_POOL_MAX,
+            init=_init_connection,
+            # startup parameters, so they survive the RESET ALL asyncpg runs on release
+            server_settings=search_settings(),
+        )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def get_pool() -> asyncpg.Pool:
+    return _pool if _pool is not None else await init_pool()
+
+
+def pool_stats():
+    if _pool is None:
+        return {"size": 0, "idle": 0}
+    return {
+        "size": _pool.get_size(),
+        "max_size": _pool.get_max_size(),
+        "idle": _pool.get_idle_size(),
+        "in_use": _pool.get_size() - _pool.get_idle_size(),
+    }
+
+
+# ---------------- Knowledge base ----------------
+async def search_vector(query_vector, k: int = TOP_K) -> List[tuple]:
+    """Async version of utils.search_vector: (id, content, distance) tuples, nearest first."""
+    if VECTOR_SEARCH_BACKEND == "ann":
+        return ann_index.search(query_vector, k)
+
+    # asyncpg keeps this as a server-side prepared statement per connection
+    pool = await get_pool()
+    rows = await pool.fetch(TOP_K_SQL, query_vector, k)
+    return [tuple(row) for row in rows]
+
+
+async def embeddings_version():
+    """Async version of utils.embeddings_version."""
+    if query_cache.version_check_due():
+        pool = await get_pool()
+        query_cache.set_version(tuple(await pool.fetchrow(EMBEDDINGS_VERSION_SQL)))
+    return query_cache.version
+
+
+async def encode_query(query: str, key: Optional[str] = None):
+    """Async version of utils.encode_query."""
+    key = key if key is not None else normalize_query(query)
+    query_vector = query_cache.get_embedding(key)
+    if query_vector is None:
+        # batched on the embedding worker thread, off the event loop
+        query_vector = await embedding_batcher.aencode(key or query)
+        query_cache.put_embedding(key, query_vector)
+    return query_vector
+
+
+
+# ---------------- Users ----------------
+async def get_user_by_email(email: str) -> Optional[asyncpg.Record]:
+    pool = await get_pool()
+    return await pool.fetchrow("SELECT id, password_hash FROM users WHERE email = $1", email)
+
+
+async def create_user(name: str, email: str, phone_number: str, birthdate: str, gender: str,
+                      password_hash: str) -> Optional[int]:
+    """New user's id, or None if the email is already registered (one round-trip, no pre-check)."""
+    pool = await get_pool()
+    return await pool.fetchval("""
+        INSERT INTO users (name, email, phone_number, birthdate, gender, password_hash)
+        VALUES ($1, $2, $3, $4::text::date, $5, $6)
+        ON CONFLICT (email) DO NOTHING
+        RETURNING id
+    """, name, email, phone_number, birthdate, gender, password_hash)
+
+
+async def update_password_hash(user_id: int, password_hash: str):
+    pool = await get_pool()
+    await pool.execute("UPDATE users SET password_hash = $2 WHERE id = $1", user_id, password_hash)
+
+
+# ---------------- Diary ----------------
+DIARY_COLUMNS = "id, user_id, date, title, content"  # not the search columns (tsvector, embedding)
+
+
+async def add_diary_entry(user_id: int, date: str, title: str, content: str) -> asyncpg.Record:
+    pool = await get_pool()
+    return await pool.fetchrow(
+        "INSERT INTO diary_entries (user_id, date, title, content) VALUES ($1, $2::text::date, $3, $4) "
+        f"RETURNING {DIARY_COLUMNS}",
+        user_id, date, title, content
+    )
+
+
+async def get_diary_entries(user_id: int, limit: int, before: Optional[tuple] = None) -> List[asyncpg.Record]:
+    """
+    Up to `limit` entries, newest first (date DESC, id DESC), served from
+    diary_entries_user_date_idx. `before` = (date, id) of the last entry of the
+    previous page; only older entries are returned.
+    """
+    pool = await get_pool()
+    if before is None:
+        return await pool.fetch(
+            f"SELECT {DIARY_COLUMNS} FROM diary_entries WHERE user_id = $1 ORDER BY date DESC, id DESC LIMIT $2",
+            user_id, limit,
+        )
+    before_date, before_id = before
+    return await pool.fetch(f"""
+        SELECT {DIARY_COLUMNS} FROM diary_entries
+        WHERE user_id = $1 AND (date, id) < ($2::date, $3)
+        ORDER BY date DESC, id DESC
+        LIMIT $4
+    """, user_id, before_date, before_id, limit)
+
+
+async def iter_diary_entries(user_id: int, prefetch: int = 500) -> AsyncIterator[asyncpg.Record]:
+    """
+    Every entry of a user, newest first, through a server-side cursor:
+    only `prefetch` rows are held in memory at a time. Keeps one pool
+    connection (in a read-only transaction) until the iteration ends.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            async for row in conn.cursor(
+                f"SELECT {DIARY_COLUMNS} FROM diary_entries WHERE user_id = $1 ORDER BY date DESC, id DESC",
+                user_id, prefetch=prefetch,
+            ):
+                yield row
+
+
+async def diary_entries_without_embedding(after_id: int, limit: int) -> List[asyncpg.Record]:
+    pool = await get_pool()
+    return await pool.fetch(
+        "SELECT id, title, content FROM diary_entries WHERE embedding IS NULL AND id > $1 ORDER BY id LIMIT $2",
+        after_id, limit,
+    )
+
+
+async def set_diary_embeddings(rows: List[tuple]):
+    """rows: (entry id, vector) pairs, written in one round-trip."""
+    pool = await get_pool()
+    await pool.executemany("UPDATE diary_entries SET embedding = $2 WHERE id = $1", rows)
+
+
+async def search_diary(user_id: int, query: str, query_vector, candidates: int) -> List[asyncpg.Record]:
+    """
+    Union of a user's best keyword matches (GIN on search_tsv, ranked by
+    ts_rank_cd) and nearest entries by cosine distance, up to `candidates` each,
+    with both scores attached. The caller combines them into one ranking.
+    """
+    pool = await get_pool()
+    return await pool.fetch("""
+        WITH q AS (SELECT websearch_to_tsquery('english', $2) AS tsq),
+        matches AS (
+            (SELECT d.id FROM diary_entries d, q
+             WHERE d.user_id = $1 AND d.search_tsv @@ q.tsq
+             ORDER BY ts_rank_cd(d.search_tsv, q.tsq) DESC
+             LIMIT $4)
+            UNION
+            (SELECT id FROM diary_entries
+             WHERE user_id = $1 AND embedding IS NOT NULL
+             ORDER BY embedding <=> $3
+             LIMIT $4)
+        )
+        SELECT d.id, d.user_id, d.date, d.title, d.content,
+               ts_rank_cd(d.search_tsv, q.tsq) AS text_score,
+               1 - (d.embedding <=> $3) AS semantic_score
+        FROM diary_entries d JOIN matches m ON m.id = d.id, q
+    """, user_id, query, query_vector, candidates)
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-import psycopg2
-import bcrypt
-from db import get_connection
+import async_db
+from password_hasher import password_hasher
+from tokens import create_access_token, get_token_claims, revoke_token
 
 router = APIRouter()
 
@@ -19,53 +20,62 @@ class LoginRequest(BaseModel):
     email: str
     password: str
 
-# Signup route
-@router.post("/signup")
-def signup(user: SignupRequest):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # check if email already exists
-    cur.execute("SELECT * FROM users WHERE email = %s", (user.email,))
-    existing = cur.fetchone()
-    if existing:
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=400, detail="Email already registered")
 
-    # hash password
-    hashed_password = bcrypt.hashpw(user.password.encode("utf-8"), bcrypt.gensalt())
+_background = set()  # running rehash tasks (keeps references until they finish)
 
-    # insert into database
-    cur.execute("""
-        INSERT INTO users (name, email, phone_number, birthdate, gender, password_hash)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """, (user.name, user.email, user.phone_number, user.birthdate, user.gender, hashed_password.decode("utf-8")))
 
+async def _rehash(user_id: int, password: str):
+    try:
+        await async_db.update_password_hash(user_id, await password_hasher.hash(password))
+    except Exception as e:
+        print(f"⚠️ Password rehash failed for user {user_id}: {e}")
 
-    conn.commit()
-    cur.close()
-    conn.close()
+
+# Signup route
+@router.post("/signup")
+async def signup(user: SignupRequest):
+    # hash password (on the bounded bcrypt pool, 503 if it's saturated)
+    hashed_password = await password_hasher.hash(user.password)
+
+    # insert into database; the unique email constraint catches duplicates
+    user_id = await async_db.create_user(
+        user.name, user.email, user.phone_number, user.birthdate, user.gender, hashed_password
+    )
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="Email already registered")
 
     return {"message": "✅ User registered successfully!"}
 
 # Login route
 @router.post("/login")
-def login(request: LoginRequest):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("SELECT id, password_hash FROM users WHERE email = %s", (request.email,))
-    user = cur.fetchone()
-
-    cur.close()
-    conn.close()
+async def login(request: LoginRequest):
+    user = await async_db.get_user_by_email(request.email)
 
     if not user:
         raise HTTPException(status_code=400, detail="Invalid email or password")
 
-    user_id, password_hash = user
-    if not bcrypt.checkpw(request.password.encode("utf-8"), password_hash.encode("utf-8")):
+    user_id, password_hash = user["id"], user["password_hash"]
+    if not await password_hasher.verify(request.password, password_hash):
         raise HTTPException(status_code=400, detail="Invalid email or password")
 
-    return {"message": "✅ Login successful!", "user_id": user_id}
+    # BCRYPT_ROUNDS changed since this hash was made: upgrade it in the background
+    if password_hasher.needs_rehash(password_hash) and password_hasher.has_capacity():
+        task = asyncio.create_task(_rehash(user_id, request.password))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+    access_token, expires_in = create_access_token(user_id)
+    return {
+        "message": "✅ Login successful!",
+        "user_id": user_id,
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_in": expires_in,
+    }
+
+
+# Logout route: the token stops working immediately (until then it's valid for ACCESS_TOKEN_TTL)
+@router.post("/logout")
+async def logout(claims: dict = Depends(get_token_claims)):
+    revoke_token(claims)
+    return {"message": "✅ Logged out"}
@@ -0,0 +1,157 @@
+# context_builder.py
+# Fits the retrieved chunks and the conversation into a fixed prompt token budget.
+#
+# - The fixed part of the prompt (instructions + question) is measured first.
+# - Of what's left, CONTEXT_SHARE goes to retrieved chunks, packed whole in rank
+#   order (a chunk that doesn't fit is skipped, never cut mid-sentence).
+# - The rest goes to history: the most recent messages verbatim, and a rolling
+#   summary of everything older. The summary is extended incrementally as
+#   messages age out of the verbatim window, never rebuilt from scratch.
+
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import List, Sequence, Tuple
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1500))
+CONTEXT_SHARE = float(os.getenv("PROMPT_CONTEXT_SHARE", 0.6))  # of the budget left after the fixed prompt text
+SUMMARY_MAX_TOKENS = int(os.getenv("PROMPT_SUMMARY_MAX_TOKENS", 150))
+MAX_RECENT_MESSAGES = int(os.getenv("PROMPT_MAX_RECENT_MESSAGES", 6))
+SUMMARY_LINE_WORDS = 25  # words kept from each message folded into the summary
+
+CHARS_PER_TOKEN = 4  # rough average for English text with Gemini / SentencePiece tokenizers
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def _format_message(message: dict) -> str:
+    return f"{message['role']}: {message['content']}"
+
+
+def pack_chunks(chunks: Sequence[str], budget: int) -> Tuple[List[str], int]:
+    """
+    Greedily keep whole chunks, best-ranked first, while they fit in `budget`.
+    If not even the top chunk fits, keep as many of its leading sentences as fit.
+    """
+    packed, used = [], 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk) + 1  # + newline separator
+        if used + cost <= budget:
+            packed.append(chunk)
+            used += cost
+    if not packed and chunks:
+        sentences = []
+        for sentence in _SENTENCE_END.split(chunks[0]):
+            cost = estimate_tokens(sentence) + 1
+            if used + cost > budget:
+                break
+            sentences.append(sentence)
+            used += cost
+        if sentences:
+            packed.append(" ".join(sentences))
+    return packed, used
+
+
+def _condense(message: dict) -> str:
+    """One short line per folded message: its first sentence, capped at SUMMARY_LINE_WORDS words."""
+    first = _SENTENCE_END.split(message["content"].strip(), maxsplit=1)[0]
+    words = first.split()
+    if len(words) > SUMMARY_LINE_WORDS:
+        first = " ".join(words[:SUMMARY_LINE_WORDS]) + " …"
+    return f"- {message['role']}: {first}"
+
+
+def fold_into_summary(summary: str, messages: Sequence[dict], budget: int = SUMMARY_MAX_TOKENS) -> str:
+    """Append condensed lines for newly aged-out messages; drop the oldest lines past `budget`."""
+    lines = summary.splitlines() if summary else []
+    lines.extend(_condense(m) for m in messages)
+    while lines and estimate_tokens("\n".join(lines)) > budget:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class BuiltContext:
+    def __init__(self, context: str, summary: str, history: str, summarized: int, usage: dict):
+        self.context = context
+        self.summary = summary
+        self.history = history
+        self.summarized = summarized  # messages now covered by `summary`
+        self.usage = usage
+
+
+def build_context(chunks: Sequence[str], messages: Sequence[dict], summary: str, summarized: int,
+                  fixed_text: str, budget: int = PROMPT_TOKEN_BUDGET) -> BuiltContext:
+    """
+    chunks:      retrieved chunk texts, best first
+    messages:    full session history, oldest first
+    summary:     rolling summary so far, covering messages[:summarized]
+    fixed_text:  the rest of the prompt (instructions + question), counted against the budget
+    """
+    fixed_tokens = estimate_tokens(fixed_text)
+    available = max(budget - fixed_tokens, 0)
+
+    packed, context_tokens = pack_chunks(chunks, int(available * CONTEXT_SHARE))
+    history_budget = available - context_tokens
+
+    # newest messages that fit verbatim (leaving room for the summary)
+    verbatim_budget = max(history_budget - min(SUMMARY_MAX_TOKENS, history_budget // 3), 0)
+    start, used = len(messages), 0
+    while start > summarized and len(messages) - start < MAX_RECENT_MESSAGES:
+        cost = estimate_tokens(_format_message(messages[start - 1])) + 1
+        if used + cost > verbatim_budget:
+            break
+        start -= 1
+        used += cost
+
+    # fold whatever just dropped out of the verbatim window into the summary
+    if start > summarized:
+        summary = fold_into_summary(summary, messages[summarized:start],
+                                    min(SUMMARY_MAX_TOKENS, max(history_budget - used, 0)))
+        summarized = start
+
+    history = "\n".join(_format_message(m) for m in messages[start:])
+    usage = {
+        "budget": budget,
+        "fixed": fixed_tokens,
+        "context": context_tokens,
+        "summary": estimate_tokens(summary),
+        "history": used,
+        "chunks_used": len(packed),
+        "chunks_dropped": len(chunks) - len(packed),
+    }
+    usage["total"] = fixed_tokens + context_tokens + usage["summary"] + used
+    return BuiltContext("\n".join(packed), summary, history, summarized, usage)
+
+
+class PromptUsage:
+    """Running per-section token usage of built prompts, for /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self._totals = defaultdict(int)
+        self.max_total = 0
+
+    def record(self, usage: dict):
+        with self._lock:
+            self.prompts += 1
+            for section, tokens in usage.items():
+                self._totals[section] += tokens
+            self.max_total = max(self.max_total, usage.get("total", 0))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "prompts": self.prompts,
+                "avg_tokens": {section: round(total / self.prompts, 1) for section, total in self._totals.items()},
+                "max_total_tokens": self.max_total,
+            }
+
+
+prompt_usage = PromptUsage()
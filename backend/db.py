@@ -1,15 +1,26 @@
 # Connects to PostgreSQL using psycopg2 and .env credentials.
 
-# Defines get_connection() → reusable DB connection function.
+# Keeps a process-wide pool of connections → get_connection() hands one out
+# as a context manager (commit on success, rollback on error, back to the pool).
 
 # Creates embeddings table (mental_health_embeddings) for AI vector search.
 
 # Creates users and diary_entries tables for authentication + journaling.
 
+# Builds and maintains the pgvector ANN index (HNSW or IVFFlat) on the embeddings,
+# and prepares the top-k similarity query on every pooled connection.
+
 # Running the file directly (python db.py) sets up all required tables.
+# python db.py reindex | index-info | explain → index maintenance / diagnostics.
 
+import argparse
 import psycopg2
+import psycopg2.extensions
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,19 +31,399 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 
-def get_connection():
-    return psycopg2.connect(
+# Pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", 30))  # ping connections idle longer than this
+
+# Vector distance used for similarity search: "l2" (<->) or "cosine" (<=>)
+VECTOR_METRIC = os.getenv("VECTOR_METRIC", "l2")
+DISTANCE_OPERATORS = {"l2": "<->", "cosine": "<=>"}
+DISTANCE_OPERATOR = DISTANCE_OPERATORS[VECTOR_METRIC]
+
+# pgvector ANN index on mental_health_embeddings.embedding
+VECTOR_INDEX_NAME = "mental_health_embeddings_embedding_idx"
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")  # "hnsw", "ivfflat" or "none"
+VECTOR_INDEX_OPCLASS = os.getenv("VECTOR_INDEX_OPCLASS") or {"l2": "vector_l2_ops", "cosine": "vector_cosine_ops"}[VECTOR_METRIC]
+HNSW_M = int(os.getenv("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 64))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 40))
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", 0))  # 0 = rows / 1000 (at least 10)
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", 10))
+
+# Server-side prepared top-k query, created once per connection
+TOP_K_STATEMENT = "mh_top_k"
+TOP_K_SQL = f"""
+    SELECT id, content, embedding {DISTANCE_OPERATOR} $1 AS distance
+    FROM mental_health_embeddings
+    ORDER BY distance
+    LIMIT $2
+"""
+
+# Upper bounds (ms) of the checkout latency histogram buckets
+CHECKOUT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, float("inf"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Connection(psycopg2.extensions.connection):
+    # set once the top-k statement has been PREPAREd on this backend
+    top_k_prepared = False
+
+
+def connect():
+    """Open a new, unpooled connection (with ANN search settings applied)."""
+    conn = psycopg2.connect(
         dbname=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD,
         host=DB_HOST,
-        port=DB_PORT
+        port=DB_PORT,
+        connection_factory=_Connection,
     )
+    with conn.cursor() as cur:
+        for statement in search_settings_sql():
+            cur.execute(statement)
+    conn.commit()
+    return conn
+
+
+def search_settings():
+    """Session settings that control ANN recall/speed for the configured index type."""
+    if VECTOR_INDEX_TYPE == "hnsw":
+        return {"hnsw.ef_search": str(HNSW_EF_SEARCH)}
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        return {"ivfflat.probes": str(IVFFLAT_PROBES)}
+    return {}
+
+
+def search_settings_sql():
+    return [f"SET {name} = {value}" for name, value in search_settings().items()]
+
+
+def execute_top_k(conn, cur, query_vector, k):
+    """Run the prepared top-k similarity query on `conn` (preparing it on first use)."""
+    _prepare_top_k(conn, cur)
+    cur.execute(f"EXECUTE {TOP_K_STATEMENT}(%s, %s)", (VectorLiteral(query_vector), k))
+    return cur.fetchall()
+
+
+def _prepare_top_k(conn, cur):
+    if not conn.top_k_prepared:
+        cur.execute(f"PREPARE {TOP_K_STATEMENT}(vector, int) AS {TOP_K_SQL}")
+        conn.top_k_prepared = True
+
+
+class VectorLiteral:
+    """
+    Adapts a float sequence / ndarray to a pgvector literal without going
+    through a Python list (psycopg2 only speaks the text protocol).
+    """
+
+    def __init__(self, values):
+        self.values = values
+
+    def getquoted(self):
+        return ("'[" + ",".join(map(repr, map(float, self.values))) + "]'").encode()
+
+
+psycopg2.extensions.register_adapter(VectorLiteral, lambda v: v)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+    Callers block (up to `timeout`) when all `maxconn` connections are checked out.
+    Connections idle for longer than `healthcheck_idle` are pinged before reuse.
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, last_used)
+        self._size = 0        # open connections (idle + in use)
+        self._closed = False
+
+        # stats
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._discarded = 0
+        self._timeouts = 0
+        self._histogram = [0] * len(CHECKOUT_BUCKETS_MS)
+
+        for _ in range(minconn):
+            self._idle.append((connect(), time.monotonic()))
+            self._size += 1
+
+    def getconn(self):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1  # reserve a slot, connect outside the lock
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"no free database connection after {self.timeout}s")
+                self._cond.wait(remaining)
+        waited = time.perf_counter() - start
+
+        try:
+            if conn is None:
+                conn = connect()
+            elif conn.closed or (time.monotonic() - last_used > self.healthcheck_idle and not _is_alive(conn)):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._discarded += 1
+                conn = connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        self._record_checkout(waited, time.perf_counter() - start)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._close_quietly(conn)
+                self._size -= 1
+                if discard:
+                    self._discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_quietly(conn)
+                self._size -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "size": self._size,
+                "max_size": self.maxconn,
+                "in_use": self._size - idle,
+                "idle": idle,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_time_total_ms": round(self._wait_total * 1000, 3),
+                "wait_time_max_ms": round(self._wait_max * 1000, 3),
+                "checkout_latency_ms": {
+                    ("+Inf" if b == float("inf") else f"le_{b}"): n
+                    for b, n in zip(CHECKOUT_BUCKETS_MS, self._histogram)
+                },
+            }
+
+    def _record_checkout(self, waited, latency):
+        latency_ms = latency * 1000
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            for i, bound in enumerate(CHECKOUT_BUCKETS_MS):
+                if latency_ms <= bound:
+                    self._histogram[i] += 1
+                    break
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _is_alive(conn):
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide pool, created lazily (and re-created after a fork)."""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool()
+                _pool_pid = os.getpid()
+    return _pool
+
+
+@contextmanager
+def get_connection():
+    """
+    Borrow a pooled connection:
+
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                ...
+
+    Commits when the block exits cleanly, rolls back on error.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
+        raise
+    finally:
+        pool.putconn(conn, discard=broken)
+
+
+def pool_stats():
+    return get_pool().stats() if _pool is not None else {"size": 0, "in_use": 0, "idle": 0}
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
 
 def create_tables():
-    conn = get_connection()
-    cur = conn.cursor()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        _create_tables(cur)
+        cur.close()
+        conn.commit()
+        create_vector_index(conn)
+    print("✅ Database tables ready!")
+
+
+def _vector_index_clause(cur):
+    """USING ... WITH (...) clause for the configured index."""
+    if VECTOR_INDEX_TYPE == "hnsw":
+        params = f"m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}"
+    elif VECTOR_INDEX_TYPE == "ivfflat":
+        lists = IVFFLAT_LISTS
+        if not lists:
+            cur.execute("SELECT count(*) FROM mental_health_embeddings")
+            lists = max(10, cur.fetchone()[0] // 1000)
+        params = f"lists = {lists}"
+    else:
+        raise ValueError(f"unknown VECTOR_INDEX_TYPE: {VECTOR_INDEX_TYPE}")
+    return f"USING {VECTOR_INDEX_TYPE} (embedding {VECTOR_INDEX_OPCLASS}) WITH ({params})"
+
+
+def create_vector_index(conn, rebuild=False):
+    """
+    Make sure the ANN index matches the configured type/opclass/parameters.
+    The configuration is stored as the index comment, so an unchanged index is left alone.
+
+    A (re)build runs CREATE INDEX CONCURRENTLY under a temporary name and then
+    swaps it in, so writes to mental_health_embeddings aren't blocked during the
+    build and searches keep using the old index until the swap. `conn` must not
+    be inside a transaction (CONCURRENTLY can't run in one).
+    """
+    building = f"{VECTOR_INDEX_NAME}_new"
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT obj_description(c.oid, 'pg_class')
+                FROM pg_class c
+                WHERE c.relname = %s AND c.relkind = 'i'
+            """, (VECTOR_INDEX_NAME,))
+            existing = cur.fetchone()
+
+            if VECTOR_INDEX_TYPE == "none":
+                if existing:
+                    cur.execute(f"DROP INDEX CONCURRENTLY {VECTOR_INDEX_NAME}")
+                return
+
+            clause = _vector_index_clause(cur)
+            if existing and existing[0] == clause and not rebuild:
+                return
+
+            print(f"Building vector index: {clause} ...")
+            start = time.perf_counter()
+            # an interrupted earlier build leaves an INVALID index behind
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {building}")
+            cur.execute(f"CREATE INDEX CONCURRENTLY {building} ON mental_health_embeddings {clause}")
+
+            # swap: brief lock, one transaction, so there's always a usable index
+            cur.execute("BEGIN")
+            try:
+                cur.execute(f"DROP INDEX IF EXISTS {VECTOR_INDEX_NAME}")
+                cur.execute(f"ALTER INDEX {building} RENAME TO {VECTOR_INDEX_NAME}")
+                cur.execute(f"COMMENT ON INDEX {VECTOR_INDEX_NAME} IS %s", (clause,))
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            cur.execute("ANALYZE mental_health_embeddings")
+            print(f"✅ Vector index built in {time.perf_counter() - start:.1f}s")
+    finally:
+        conn.autocommit = False
+
+
+def index_info(cur):
+    cur.execute("""
+        SELECT pg_size_pretty(pg_relation_size(c.oid)), pg_get_indexdef(c.oid),
+               pg_size_pretty(pg_total_relation_size('mental_health_embeddings')),
+               (SELECT count(*) FROM mental_health_embeddings)
+        FROM pg_class c
+        WHERE c.relname = %s AND c.relkind = 'i'
+    """, (VECTOR_INDEX_NAME,))
+    return cur.fetchone()
+
+
+def explain_top_k(conn, cur, k=5):
+    """EXPLAIN ANALYZE the prepared top-k query, probing with a stored embedding."""
+    cur.execute("SELECT embedding::real[] FROM mental_health_embeddings LIMIT 1")
+    row = cur.fetchone()
+    if row is None:
+        return []
+    _prepare_top_k(conn, cur)
+    cur.execute(f"EXPLAIN (ANALYZE, BUFFERS) EXECUTE {TOP_K_STATEMENT}(%s, %s)", (VectorLiteral(row[0]), k))
+    return [line[0] for line in cur.fetchall()]
+
 
+def _create_tables(cur):
     # Extension for vector similarity search
     cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
 
@@ -45,6 +436,43 @@ def create_tables():
         );
     """)
 
+    # Source PDFs (one row per file, with its content hash) → lets huggingface_embedder
+    # skip unchanged files and diff changed ones
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ingested_documents (
+            id SERIAL PRIMARY KEY,
+            filename TEXT UNIQUE NOT NULL,
+            content_hash CHAR(64) NOT NULL,
+            pages INT NOT NULL,
+            chunks INT NOT NULL,
+            ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    # Tables created before chunk provenance were keyed by content hash (one row per file
+    # version); bring them to one row per filename
+    cur.execute("ALTER TABLE ingested_documents DROP CONSTRAINT IF EXISTS ingested_documents_content_hash_key;")
+    cur.execute("""
+        DELETE FROM ingested_documents old USING ingested_documents newer
+        WHERE old.filename = newer.filename AND old.id < newer.id;
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ingested_documents_filename_key
+        ON ingested_documents (filename);
+    """)
+
+    # Chunk provenance: source document, page range and content hash (one copy per document)
+    cur.execute("""
+        ALTER TABLE mental_health_embeddings
+            ADD COLUMN IF NOT EXISTS document_id INT REFERENCES ingested_documents(id) ON DELETE CASCADE,
+            ADD COLUMN IF NOT EXISTS page_start INT,
+            ADD COLUMN IF NOT EXISTS page_end INT,
+            ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS mental_health_embeddings_document_chunk_key
+        ON mental_health_embeddings (document_id, content_hash);
+    """)
+
     # Users table for authentication
     cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -66,6 +494,24 @@ def create_tables():
             content TEXT NOT NULL
         );
     """)
+    # newest-first listing per user, with id as the tie-breaker for keyset pagination
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS diary_entries_user_date_idx
+        ON diary_entries (user_id, date DESC, id DESC);
+    """)
+    # diary search: keyword index (generated tsvector) + entry embedding, filled in by diary_embedder.py.
+    # Searches are per user, so the embedding is compared exactly over one user's rows (no ANN index).
+    cur.execute("""
+        ALTER TABLE diary_entries
+            ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS (
+                to_tsvector('english', coalesce(title, '') || ' ' || coalesce(content, ''))
+            ) STORED,
+            ADD COLUMN IF NOT EXISTS embedding vector(384);
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS diary_entries_search_idx
+        ON diary_entries USING GIN (search_tsv);
+    """)
     cur.execute("""
         CREATE TABLE IF NOT EXISTS chat_sessions (
         id SERIAL PRIMARY KEY,
@@ -75,6 +521,8 @@ def create_tables():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
     """)
+    # session reloads and the per-request freshness check (session_store.py) look sessions up by id
+    cur.execute("CREATE INDEX IF NOT EXISTS chat_sessions_session_idx ON chat_sessions (session_id, id);")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS feedback (
         id SERIAL PRIMARY KEY,
@@ -84,13 +532,33 @@ def create_tables():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
       );
     """)
+    cur.execute("CREATE INDEX IF NOT EXISTS feedback_session_idx ON feedback (session_id, id);")
 
-    
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("✅ Database tables ready!")
 
 if __name__ == "__main__":
-    create_tables()
+    parser = argparse.ArgumentParser(description="Database setup and vector index maintenance")
+    parser.add_argument("command", nargs="?", default="create", choices=["create", "reindex", "index-info", "explain"])
+    args = parser.parse_args()
+
+    if args.command == "create":
+        create_tables()
+    elif args.command == "reindex":
+        with get_connection() as conn:
+            create_vector_index(conn, rebuild=True)
+    elif args.command == "index-info":
+        with get_connection() as conn, conn.cursor() as cur:
+            info = index_info(cur)
+        if info is None:
+            print(f"No vector index ({VECTOR_INDEX_NAME}) found.")
+        else:
+            index_size, definition, table_size, rows = info
+            print(f"Index:      {definition}")
+            print(f"Index size: {index_size}")
+            print(f"Table size: {table_size} ({rows} rows)")
+    elif args.command == "explain":
+        with get_connection() as conn, conn.cursor() as cur:
+            plan = explain_top_k(conn, cur)
+        print("\n".join(plan) or "mental_health_embeddings is empty.")
+        if plan:
+            used = any(VECTOR_INDEX_NAME in line for line in plan)
+            print(f"\n{'✅' if used else '❌'} vector index {'used' if used else 'NOT used'} by the top-k query")
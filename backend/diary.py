@@ -1,37 +1,142 @@
 # backend/diary.py
-from fastapi import APIRouter, HTTPException
+import base64
+import csv
+import io
+import json
+import os
+from datetime import date
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List
-from db import get_connection
+from typing import List, Optional
+import async_db
+from diary_embedder import diary_embedder
+from tokens import get_current_user
+from utils import embedding_batcher
 
 router = APIRouter()
 
+DIARY_PAGE_SIZE = int(os.getenv("DIARY_PAGE_SIZE", 50))
+DIARY_MAX_PAGE_SIZE = int(os.getenv("DIARY_MAX_PAGE_SIZE", 200))
+EXPORT_FIELDS = ["id", "date", "title", "content"]
+DIARY_SEARCH_SEMANTIC_WEIGHT = float(os.getenv("DIARY_SEARCH_SEMANTIC_WEIGHT", 0.6))  # rest goes to keyword rank
+DIARY_SEARCH_CANDIDATES = int(os.getenv("DIARY_SEARCH_CANDIDATES", 50))  # per retriever, before re-ranking
+
 class DiaryEntry(BaseModel):
-    user_id: int
+    user_id: Optional[int] = None  # taken from the access token; if sent, it must match
     date: str
     title: str
     content: str
 
+class DiarySearchResult(DiaryEntry):
+    score: float
+    text_score: float
+    semantic_score: float
+
+def _to_entry(row) -> DiaryEntry:
+    return DiaryEntry(user_id=row["user_id"], date=row["date"].isoformat(), title=row["title"], content=row["content"])
+
+def _check_owner(user_id: Optional[int], current_user: int):
+    if user_id is not None and user_id != current_user:
+        raise HTTPException(status_code=403, detail="Not allowed to access another user's diary")
+
+# Opaque page cursor: (date, id) of the last entry returned
+def _encode_cursor(row) -> str:
+    return base64.urlsafe_b64encode(f"{row['date'].isoformat()}|{row['id']}".encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        day, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return date.fromisoformat(day), int(entry_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.post("/diary", response_model=DiaryEntry)
-def add_entry(entry: DiaryEntry):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO diary_entries (user_id, date, title, content) VALUES (%s, %s, %s, %s) RETURNING *",
-        (entry.user_id, entry.date, entry.title, entry.content)
-    )
-    saved_entry = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
-    return saved_entry
+async def add_entry(entry: DiaryEntry, current_user: int = Depends(get_current_user)):
+    _check_owner(entry.user_id, current_user)
+    saved_entry = await async_db.add_diary_entry(current_user, entry.date, entry.title, entry.content)
+    diary_embedder.enqueue(saved_entry["id"], entry.title, entry.content)  # embedded in the background
+    return _to_entry(saved_entry)
 
 @router.get("/diary/{user_id}", response_model=List[DiaryEntry])
-def get_entries(user_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM diary_entries WHERE user_id=%s ORDER BY date DESC", (user_id,))
-    entries = cur.fetchall()
-    cur.close()
-    conn.close()
-    return entries
+async def get_entries(
+    user_id: int,
+    response: Response,
+    limit: int = Query(DIARY_PAGE_SIZE, ge=1, le=DIARY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: int = Depends(get_current_user),
+):
+    """Newest first, one page at a time; pass the X-Next-Cursor header back as `cursor` for the next page."""
+    _check_owner(user_id, current_user)
+    before = _decode_cursor(cursor) if cursor else None
+    entries = await async_db.get_diary_entries(user_id, limit + 1, before)
+    if len(entries) > limit:
+        entries = entries[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(entries[-1])
+    return [_to_entry(row) for row in entries]
+
+@router.get("/diary/{user_id}/search", response_model=List[DiarySearchResult])
+async def search_entries(
+    user_id: int,
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: int = Depends(get_current_user),
+):
+    """
+    Keyword + meaning search over a user's diary. Each candidate's score is
+    DIARY_SEARCH_SEMANTIC_WEIGHT * cosine similarity + the rest * keyword rank
+    (ts_rank_cd scaled to the best keyword match), so entries that match either
+    way can rank, and ones that match both rank highest.
+    """
+    _check_owner(user_id, current_user)
+    # encoded directly, not through the knowledge-base query cache: private text
+    # shouldn't sit in (or evict entries from) the cache every chat request uses
+    query_vector = await embedding_batcher.aencode(q)
+    rows = await async_db.search_diary(user_id, q, query_vector, DIARY_SEARCH_CANDIDATES)
+
+    best_text = max((row["text_score"] for row in rows), default=0.0) or 1.0
+    results = []
+    for row in rows:
+        text_score = row["text_score"] / best_text
+        semantic_score = max(row["semantic_score"] or 0.0, 0.0)  # NULL until the entry is embedded
+        score = DIARY_SEARCH_SEMANTIC_WEIGHT * semantic_score + (1 - DIARY_SEARCH_SEMANTIC_WEIGHT) * text_score
+        results.append(DiarySearchResult(
+            **_to_entry(row).model_dump(),
+            score=round(score, 4), text_score=round(text_score, 4), semantic_score=round(semantic_score, 4),
+        ))
+    results.sort(key=lambda r: r.score, reverse=True)
+    return results[:limit]
+
+@router.get("/diary/{user_id}/export")
+async def export_entries(
+    user_id: int,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: int = Depends(get_current_user),
+):
+    """The whole diary, streamed from a server-side cursor as NDJSON (one entry per line) or CSV."""
+    _check_owner(user_id, current_user)
+
+    async def ndjson():
+        async for row in async_db.iter_diary_entries(user_id):
+            yield json.dumps({
+                "id": row["id"], "date": row["date"].isoformat(), "title": row["title"], "content": row["content"],
+            }) + "\n"
+
+    async def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        async for row in async_db.iter_diary_entries(user_id):
+            writer.writerow([row["id"], row["date"].isoformat(), row["title"], row["content"]])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    if format == "csv":
+        body, media_type = csv_rows(), "text/csv"
+    else:
+        body, media_type = ndjson(), "application/x-ndjson"
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="diary-{user_id}.{format}"',
+    })
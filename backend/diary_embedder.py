@@ -0,0 +1,111 @@
+# diary_embedder.py
+# Computes diary entry embeddings (for /diary/{user_id}/search) off the write path.
+#
+# add_entry only enqueues the new entry; a background task drains the queue in
+# batches of up to DIARY_EMBED_BATCH entries (waiting at most
+# DIARY_EMBED_DELAY_MS for a batch to fill), encodes them through the shared
+# embedding batcher and stores all vectors in one statement. On startup,
+# entries still without an embedding (written before a restart, or whose batch
+# failed) are backfilled the same way.
+
+import asyncio
+import os
+import time
+
+import async_db
+from utils import embedding_batcher
+
+DIARY_EMBED_BATCH = int(os.getenv("DIARY_EMBED_BATCH", 16))
+DIARY_EMBED_DELAY_MS = float(os.getenv("DIARY_EMBED_DELAY_MS", 200))
+
+
+def entry_text(title: str, content: str) -> str:
+    return f"{title}. {content}"
+
+
+class DiaryEmbedder:
+    def __init__(self, batch_size: int = DIARY_EMBED_BATCH, delay_ms: float = DIARY_EMBED_DELAY_MS):
+        self.batch_size = max(1, batch_size)
+        self.delay = delay_ms / 1000
+        self._queue = None
+        self._task = None
+
+        self.embedded = 0
+        self.batches = 0
+        self.errors = 0
+        self.backfilled = 0
+
+    def enqueue(self, entry_id: int, title: str, content: str):
+        # before start() (e.g. scripts) entries are simply left for the next backfill
+        if self._queue is not None:
+            self._queue.put_nowait((entry_id, entry_text(title, content)))
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._queue = None
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "embedded": self.embedded,
+            "batches": self.batches,
+            "backfilled": self.backfilled,
+            "errors": self.errors,
+        }
+
+    async def _run(self):
+        await self._backfill()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._embed(batch)
+
+    async def _backfill(self):
+        last_id = 0
+        while True:
+            try:
+                rows = await async_db.diary_entries_without_embedding(last_id, self.batch_size)
+            except Exception as e:
+                print(f"⚠️ Diary embedding backfill failed: {e}")
+                return
+            if not rows:
+                return
+            last_id = rows[-1]["id"]
+            if await self._embed([(row["id"], entry_text(row["title"], row["content"])) for row in rows]):
+                self.backfilled += len(rows)
+
+    async def _embed(self, batch) -> bool:
+        try:
+            # each text joins the shared batcher queue, so this is one (or a few) forward passes
+            vectors = await asyncio.gather(*(embedding_batcher.aencode(text) for _, text in batch))
+            await async_db.set_diary_embeddings([(entry_id, vector) for (entry_id, _), vector in zip(batch, vectors)])
+        except Exception as e:
+            # left NULL; picked up by the backfill on next startup
+            self.errors += 1
+            print(f"❌ Diary embedding batch failed: {e}")
+            return False
+        self.batches += 1
+        self.embedded += len(batch)
+        return True
+
+
+diary_embedder = DiaryEmbedder()
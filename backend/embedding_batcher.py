@@ -0,0 +1,104 @@
+# embedding_batcher.py
+# Micro-batching front end for SentenceTransformer.encode.
+#
+# Concurrent callers (/chat, /upload, /voice-query, ...) each submit one string;
+# a single worker thread gathers whatever arrives within EMBED_BATCH_MAX_LATENCY_MS
+# (up to EMBED_BATCH_MAX_SIZE texts) and runs one batched forward pass.
+# Results go back to each caller through a Future.
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", 32))
+EMBED_BATCH_MAX_LATENCY_MS = float(os.getenv("EMBED_BATCH_MAX_LATENCY_MS", 5))
+
+
+class EmbeddingBatcher:
+    def __init__(self, model, max_batch_size: int = EMBED_BATCH_MAX_SIZE,
+                 max_latency_ms: float = EMBED_BATCH_MAX_LATENCY_MS):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_latency = max_latency_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.queue_wait_total = 0.0
+        self.encode_time_total = 0.0
+
+    def submit(self, text: str) -> Future:
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, text: str):
+        """Blocking: embedding for one text (batched with whatever else is in flight)."""
+        return self.submit(text).result()
+
+    async def aencode(self, text: str):
+        """Awaitable version of encode(); does not tie up a threadpool worker."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def stats(self):
+        with self._stats_lock:
+            batches = self.batches or 1
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "max_batch_size": self.max_batch_size,
+                "largest_batch": self.largest_batch,
+                "avg_batch_size": round(self.items / batches, 2),
+                "avg_fill_ratio": round(self.items / (batches * self.max_batch_size), 3),
+                "avg_queue_wait_ms": round(self.queue_wait_total / max(self.items, 1) * 1000, 3),
+                "avg_encode_ms": round(self.encode_time_total / batches * 1000, 3),
+            }
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                vectors = self.model.encode([text for text, _, _ in batch], batch_size=len(batch))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                self.queue_wait_total += sum(started - queued for _, _, queued in batch)
+                self.encode_time_total += time.perf_counter() - started
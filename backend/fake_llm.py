@@ -0,0 +1,20 @@
+# fake_llm.py
+# Offline stand-in for the Gemini chat model (CHAT_LLM=fake).
+# Streams its canned replies a few characters at a time, so /chat/stream and the
+# rest of the chat path can be exercised without an API key or network.
+import os
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+FAKE_LLM_DELAY = float(os.getenv("FAKE_LLM_DELAY", 0.02))  # seconds between streamed chunks
+
+FAKE_RESPONSES = [
+    "It sounds like this has been a difficult time for your family. Keeping routines predictable and "
+    "giving advance warning before transitions often helps. Please talk to your child's doctor or "
+    "therapist for advice tailored to your situation.",
+    "Many parents find it helpful to write down when the behaviour happens and what came just before it. "
+    "Sharing those notes with a professional can make the next appointment much more useful.",
+]
+
+
+def fake_chat_llm():
+    return FakeListChatModel(responses=FAKE_RESPONSES, sleep=FAKE_LLM_DELAY)
@@ -1,46 +1,247 @@
+import argparse
+import hashlib
+import multiprocessing
 import os
-import psycopg2
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from sentence_transformers import SentenceTransformer
-from db import get_connection  # your existing DB connection
+from psycopg2.extras import execute_values
+from db import get_connection, VectorLiteral  # your existing DB connection
+import ann_index
 
 load_dotenv()
 
 PDF_FOLDER = "data"  # folder where PDFs are stored
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"  # 384-dim embeddings
 
-# Load HuggingFace embedding model
-model = SentenceTransformer(MODEL_NAME)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", max(1, (os.cpu_count() or 2) - 1)))  # PDF parsing processes
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))  # chunks per encode() forward pass
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
 
-def embed_pdf(pdf_path, cur):
-    print(f"Processing {pdf_path} ...")
-    loader = PyPDFLoader(pdf_path)
-    documents = loader.load()
+# HuggingFace embedding model, loaded on first use so the parser processes don't load it
+_model = None
+
+def get_model():
+    global _model
+    if _model is None:
+        from sentence_transformers import SentenceTransformer
+        _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_and_split(pdf_path):
+    """
+    Parse a PDF and split it into chunks. Runs in a worker process.
+    Returns (page_count, [(chunk_text, page_number), ...]).
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import PyPDFLoader
+
+    documents = PyPDFLoader(pdf_path).load()
 
     # Split text into chunks
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
     docs = text_splitter.split_documents(documents)
+    return len(documents), [(doc.page_content, doc.metadata.get("page")) for doc in docs]
+
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def known_documents():
+    """filename → (document id, content hash) for everything already embedded."""
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT filename, id, content_hash FROM ingested_documents")
+        return {filename: (doc_id, content_hash) for filename, doc_id, content_hash in cur.fetchall()}
+
+
+def existing_chunk_hashes(doc_id):
+    if doc_id is None:
+        return set()
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT content_hash FROM mental_health_embeddings WHERE document_id = %s", (doc_id,))
+        return {row[0] for row in cur.fetchall()}
+
+
+def sync_document(filename, content_hash, pages, chunks, doc_id, batch_size):
+    """
+    Bring one document's chunks in line with the parsed PDF: only chunks whose
+    hash is new get encoded and inserted, vanished ones are deleted, the rest stay.
+    Everything for the document is committed in one transaction.
+    Returns (added, removed, unchanged) chunk counts.
+    """
+    # dedupe identical chunks within the document (repeated headers, footers, ...)
+    by_hash = {}
+    for text, page in chunks:
+        by_hash.setdefault(chunk_hash(text), (text, page))
+
+    existing = existing_chunk_hashes(doc_id)
+    new = [(h, text, page) for h, (text, page) in by_hash.items() if h not in existing]
+    removed = list(existing - by_hash.keys())
+    vectors = get_model().encode([text for _, text, _ in new], batch_size=batch_size) if new else []
+
+    with get_connection() as conn, conn.cursor() as cur:
+        if doc_id is None:
+            cur.execute("""
+                INSERT INTO ingested_documents (filename, content_hash, pages, chunks)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id
+            """, (filename, content_hash, pages, len(by_hash)))
+            doc_id = cur.fetchone()[0]
+        else:
+            cur.execute("""
+                UPDATE ingested_documents
+                SET content_hash = %s, pages = %s, chunks = %s, ingested_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (content_hash, pages, len(by_hash), doc_id))
+        if removed:
+            cur.execute(
+                "DELETE FROM mental_health_embeddings WHERE document_id = %s AND content_hash = ANY(%s)",
+                (doc_id, removed)
+            )
+        if new:
+            execute_values(
+                cur,
+                """
+                INSERT INTO mental_health_embeddings (content, embedding, document_id, page_start, page_end, content_hash)
+                VALUES %s
+                ON CONFLICT (document_id, content_hash) DO NOTHING
+                """,
+                [(text, VectorLiteral(vector), doc_id, page, page, h) for (h, text, page), vector in zip(new, vectors)],
+                page_size=500,
+            )
+    return len(new), len(removed), len(by_hash) - len(new)
 
-    for doc in docs:
-        text = doc.page_content
-        vector = model.encode(text).tolist()  # 384-dim list of floats
+
+def has_legacy_chunks():
+    """True if the table still holds chunks embedded before provenance was tracked (document_id NULL)."""
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM mental_health_embeddings WHERE document_id IS NULL)")
+        return cur.fetchone()[0]
+
+
+def forget_documents_without_chunks():
+    """
+    Drop manifest rows that have no chunks attached: files recorded before provenance
+    was tracked, whose chunks are the legacy ones. They get re-ingested in this run.
+    """
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM ingested_documents d
+            WHERE NOT EXISTS (SELECT 1 FROM mental_health_embeddings e WHERE e.document_id = d.id)
+        """)
+
+
+def remove_legacy_chunks():
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM mental_health_embeddings WHERE document_id IS NULL")
+        return cur.rowcount
+
+
+def remove_missing_documents(present_filenames):
+    """Drop documents (and, by cascade, their chunks) whose PDF is gone."""
+    with get_connection() as conn, conn.cursor() as cur:
         cur.execute(
-            "INSERT INTO mental_health_embeddings (content, embedding) VALUES (%s, %s)",
-            (text, vector)
+            "DELETE FROM ingested_documents WHERE NOT (filename = ANY(%s)) RETURNING filename",
+            (list(present_filenames),)
         )
+        return [row[0] for row in cur.fetchall()]
+
 
-def embed_all_pdfs():
-    conn = get_connection()
-    cur = conn.cursor()
-    for filename in os.listdir(PDF_FOLDER):
+def embed_all_pdfs(folder=PDF_FOLDER, workers=INGEST_WORKERS, batch_size=INGEST_BATCH_SIZE, sync=False):
+    """
+    Incrementally bring the knowledge base in line with the PDFs in `folder`.
+
+    Unchanged files (same content hash) are skipped without being parsed. New and
+    changed files are parsed on a process pool while the main process encodes
+    finished documents; only chunks that actually changed are re-embedded, and each
+    document is committed on its own so an interrupted run can simply be resumed.
+    With sync=True, documents whose file was deleted are removed as well.
+
+    Chunks from before provenance was tracked (no document_id) are replaced: their
+    files are re-ingested and the legacy rows deleted once the run is done, so the
+    table never holds both copies after a run.
+    """
+    legacy = has_legacy_chunks()
+    if legacy:
+        print("Found chunks without a source document; re-ingesting all PDFs to replace them")
+        forget_documents_without_chunks()
+    documents = known_documents()
+    present, todo = set(), []
+    for filename in sorted(os.listdir(folder)):
         if filename.lower().endswith(".pdf"):
-            embed_pdf(os.path.join(PDF_FOLDER, filename), cur)
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("✅ All PDFs embedded successfully!")
+            present.add(filename)
+            path = os.path.join(folder, filename)
+            content_hash = file_hash(path)
+            doc_id, known_hash = documents.get(filename, (None, None))
+            if known_hash == content_hash:
+                print(f"Skipping {filename} (unchanged)")
+            else:
+                todo.append((filename, path, content_hash, doc_id))
+
+    start = time.perf_counter()
+    total_pages = total_added = total_removed = failed = 0
+
+    # spawned, not forked: the workers must not inherit the model (loaded by sync_document
+    # on first use) or the tokenizer's threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(load_and_split, path): (filename, content_hash, doc_id)
+            for filename, path, content_hash, doc_id in todo
+        }
+        for future in as_completed(futures):
+            filename, content_hash, doc_id = futures[future]
+            try:
+                pages, chunks = future.result()
+                doc_start = time.perf_counter()
+                added, removed, unchanged = sync_document(filename, content_hash, pages, chunks, doc_id, batch_size)
+            except Exception as e:
+                failed += 1
+                print(f"❌ Failed to embed {filename}: {e}")
+                continue
+            total_pages += pages
+            total_added += added
+            total_removed += removed
+            print(f"Embedded {filename}: {pages} pages, +{added} / -{removed} chunks ({unchanged} unchanged) "
+                  f"in {time.perf_counter() - doc_start:.1f}s")
+
+    if legacy:
+        if failed:
+            print("⚠️ Keeping legacy chunks until every PDF has been re-ingested")
+        else:
+            print(f"Removed {remove_legacy_chunks()} legacy chunks without a source document")
+    if sync:
+        for filename in remove_missing_documents(present):
+            print(f"Removed {filename} (file deleted)")
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"{total_pages} pages, {total_added} chunks embedded, {total_removed} removed in {elapsed:.1f}s "
+          f"({total_pages / elapsed:.1f} pages/s, {total_added / elapsed:.1f} chunks/s)")
+
+    # pick up the new rows if an ANN index lives in this process
+    if ann_index.is_loaded():
+        ann_index.refresh()
+    if failed:
+        print(f"⚠️ {failed} PDF(s) failed, re-run to retry them.")
+    else:
+        print("✅ All PDFs embedded successfully!")
 
 if __name__ == "__main__":
-    embed_all_pdfs()
+    parser = argparse.ArgumentParser(description="Embed the PDFs in the knowledge-base folder")
+    parser.add_argument("--folder", default=PDF_FOLDER)
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--sync", action="store_true",
+                        help="also remove documents whose PDF was deleted")
+    args = parser.parse_args()
+    embed_all_pdfs(args.folder, args.workers, args.batch_size, sync=args.sync)
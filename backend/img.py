@@ -1,17 +1,18 @@
 import os
-import io
-import tempfile
-import fitz  # PyMuPDF
-from PIL import Image
-import easyocr
-from fastapi import APIRouter, UploadFile, Form, HTTPException
+import asyncio
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import APIRouter, Depends, UploadFile, Form, HTTPException
 from fastapi.responses import JSONResponse
-from fastapi.concurrency import run_in_threadpool  # ✅ Import this
-from agent import ask_agent  # ✅ your existing AI logic from main.py
+from agent import ask_agent_async  # ✅ your existing AI logic from main.py
+import ocr
+from storage import save_upload, uploads
+from tokens import get_current_user
 
 router = APIRouter()
-UPLOAD_DIR = "uploaded_media"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+UPLOAD_DIR = uploads.directory
 
 ALLOWED_TYPES = {
     "image": ["image/png", "image/jpeg", "image/jpg"],
@@ -19,50 +20,140 @@ ALLOWED_TYPES = {
     "pdf": ["application/pdf"]
 }
 
-# Initialize EasyOCR reader once
-reader = easyocr.Reader(['en'], gpu=False)
+# OCR / PDF extraction runs in its own processes so it never blocks the event loop
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", 2))
+OCR_MAX_QUEUE = int(os.getenv("OCR_MAX_QUEUE", 8))  # jobs allowed to wait for a worker before we answer 503
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", 256))  # extracted texts kept by file content hash
+PDF_OCR_PARALLEL = int(os.getenv("PDF_OCR_PARALLEL", OCR_WORKERS))  # scanned pages of one PDF in flight at once
 
+_ocr_executor = None
+_ocr_jobs = 0  # running + queued (PDF pages count one each), only touched from the event loop
+_ocr_cache = OrderedDict()  # sha256 -> extracted text
+
+
+def get_ocr_executor():
+    global _ocr_executor
+    if _ocr_executor is None:
+        _ocr_executor = ProcessPoolExecutor(
+            max_workers=OCR_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=ocr.init_worker,
+        )
+    return _ocr_executor
 
-def extract_text_from_image(image_path: str) -> str:
-    try:
-        results = reader.readtext(image_path, detail=0)
-        if not results:
-            return ""
-        return " ".join(results)
-    except Exception as e:
-        print(f"Image OCR error: {e}")
-        return ""
 
+def shutdown_ocr_executor():
+    global _ocr_executor
+    if _ocr_executor is not None:
+        _ocr_executor.shutdown(wait=False, cancel_futures=True)
+        _ocr_executor = None
 
-def extract_text_from_video(video_path: str) -> str:
+
+async def _ocr_page(file_path: str, index: int, semaphore: asyncio.Semaphore):
+    """One scanned page on the pool, counted in _ocr_jobs while it runs. (index, text or None, timings)."""
+    global _ocr_jobs
+    async with semaphore:
+        _ocr_jobs += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                get_ocr_executor(), ocr.ocr_pdf_page, file_path, index, ocr.PDF_OCR_DPI
+            )
+        except Exception as e:
+            print(f"PDF OCR error on page {index + 1}: {e}")
+            return index, None, {"decode": 0.0, "ocr": 0.0}
+        finally:
+            _ocr_jobs -= 1
+
+
+async def _extract_pdf(file_path: str, progress=None):
+    """
+    Text layer in one pool job, then every scanned page as its own job so a
+    scanned document is OCR'd on several workers at once. At most
+    PDF_OCR_PARALLEL pages of a document are submitted at a time, and each
+    counts against the OCR_MAX_QUEUE budget, so one long scan can't flood the
+    pool. A page that fails keeps its (short) text layer; the other pages are
+    still used. Returns (text, timings, complete): complete is False if any page failed.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    texts, scanned, total = await loop.run_in_executor(
+        get_ocr_executor(), ocr.pdf_text_layer, file_path, ocr.PDF_MAX_PAGES
+    )
+    timings = {"decode": time.perf_counter() - start, "ocr": 0.0}
+    print(f"[DEBUG] PDF: {len(texts)}/{total} pages read, {len(scanned)} need OCR")
+
+    failed = 0
+    semaphore = asyncio.Semaphore(max(1, PDF_OCR_PARALLEL))
+    jobs = [asyncio.create_task(_ocr_page(file_path, index, semaphore)) for index in scanned]
     try:
-        import moviepy.editor as mp
-        clip = mp.VideoFileClip(video_path)
-        frame = clip.get_frame(clip.duration / 2)
-        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp_img:
-            Image.fromarray(frame).save(tmp_img.name)
-            text = extract_text_from_image(tmp_img.name)
-        clip.close()
-        return text
-    except Exception as e:
-        print(f"Video OCR error: {e}")
-        return ""
-
-
-def extract_text_from_pdf(pdf_path: str) -> str:
+        for done, job in enumerate(asyncio.as_completed(jobs), 1):
+            index, text, page_timings = await job
+            if text is not None:
+                texts[index] = text
+            else:
+                failed += 1
+            # summed worker time, not wall time
+            timings["decode"] += page_timings["decode"]
+            timings["ocr"] += page_timings["ocr"]
+            if progress is not None:
+                progress(done, len(scanned))
+    finally:
+        # request cancelled (or failed): don't leave pages queued on the pool
+        for job in jobs:
+            job.cancel()
+    return ocr.join_pages(texts), timings, not failed
+
+
+def _log_pdf_progress(done: int, total: int):
+    print(f"[DEBUG] PDF OCR: {done}/{total} scanned pages done")
+
+
+async def run_extraction(media_type: str, file_path: str, content_hash: str):
+    """
+    Extract text on the OCR pool (or from cache). Returns (text, timings, cached).
+    Only complete, non-empty results are cached, so a failed or partial run is
+    retried when the same file is uploaded again.
+    """
+    global _ocr_jobs
+    cached = _ocr_cache.get(content_hash)
+    if cached is not None:
+        _ocr_cache.move_to_end(content_hash)
+        return cached, {}, True
+
+    if _ocr_jobs >= OCR_WORKERS + OCR_MAX_QUEUE:
+        raise HTTPException(status_code=503, detail="Too many files are being processed, please retry shortly",
+                            headers={"Retry-After": "5"})
+    _ocr_jobs += 1
     try:
-        text = ""
-        with fitz.open(pdf_path) as doc:
-            for page in doc:
-                text += page.get_text("text")
-        return text.strip()
-    except Exception as e:
-        print(f"PDF OCR error: {e}")
-        return ""
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        if media_type == "pdf":
+            try:
+                text, timings, ok = await _extract_pdf(file_path, progress=_log_pdf_progress)
+            except Exception as e:
+                print(f"PDF OCR error: {e}")
+                text, timings, ok = "", {"decode": 0.0, "ocr": 0.0}, False
+            timings["total"] = time.perf_counter() - submitted
+        else:
+            text, timings, ok = await loop.run_in_executor(get_ocr_executor(), ocr.extract, media_type, file_path)
+            timings["queue"] = max(time.perf_counter() - submitted - timings["decode"] - timings["ocr"], 0.0)
+    finally:
+        _ocr_jobs -= 1
+
+    if ok and text.strip():
+        _ocr_cache[content_hash] = text
+        while len(_ocr_cache) > OCR_CACHE_SIZE:
+            _ocr_cache.popitem(last=False)
+    return text, timings, False
+
+
+def ocr_stats():
+    return {"workers": OCR_WORKERS, "jobs": _ocr_jobs, "max_jobs": OCR_WORKERS + OCR_MAX_QUEUE,
+            "cached_results": len(_ocr_cache)}
 
 
 @router.post("/upload")
-async def upload_media(file: UploadFile, session_id: str = Form(...)):
+async def upload_media(file: UploadFile, session_id: str = Form(...), user_id: int = Depends(get_current_user)):
     content_type = file.content_type
     media_type = None
     for key, types in ALLOWED_TYPES.items():
@@ -73,22 +164,16 @@ async def upload_media(file: UploadFile, session_id: str = Form(...)):
     if not media_type:
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
+    # streamed to disk in chunks, stored as <sha256><ext>
+    file_path, content_hash, _ = await save_upload(file, uploads)
 
-    extracted_text = ""
-    if media_type == "image":
-        extracted_text = extract_text_from_image(file_path)
-    elif media_type == "video":
-        extracted_text = extract_text_from_video(file_path)
-    elif media_type == "pdf":
-        extracted_text = extract_text_from_pdf(file_path)
+    extracted_text, timings, cached = await run_extraction(media_type, file_path, content_hash)
 
-    # ✅ FIXED: use run_in_threadpool since ask_agent is synchronous
     if extracted_text.strip():
         try:
-            res = await run_in_threadpool(ask_agent, session_id, extracted_text)
+            start = time.perf_counter()
+            res = await ask_agent_async(session_id, extracted_text)
+            timings["llm"] = time.perf_counter() - start
             ai_reply = res if isinstance(res, str) else res.get("reply", "No response generated.")
         except Exception as e:
             ai_reply = f"Error getting AI reply: {str(e)}"
@@ -97,8 +182,10 @@ async def upload_media(file: UploadFile, session_id: str = Form(...)):
 
     return JSONResponse({
         "filename": file.filename,
-        "url": f"/{UPLOAD_DIR}/{file.filename}",
+        "url": f"/{UPLOAD_DIR}/{os.path.basename(file_path)}",
         "type": media_type,
         "extracted_text": extracted_text.strip(),
-        "ai_reply": ai_reply
+        "ai_reply": ai_reply,
+        "cached": cached,
+        "timings_ms": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
     })
@@ -1,13 +1,28 @@
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+from contextlib import aclosing
+from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from voiceassistant import router as voice_router
+from voiceassistant import router as voice_router, close_chat_client, prerender_canned_replies, tts_cache
 from auth import router as auth_router
-from img import router as img_router  # ✅ Added image router
-from agent import ask_agent
-from state import chat_sessions, feedback_store
+from password_hasher import password_hasher
+from tokens import get_current_user, revocations
+from diary_embedder import diary_embedder
+import retrieval
+from diary import router as diary_router
+from img import router as img_router, ocr_stats, shutdown_ocr_executor  # ✅ Added image router
+from agent import ask_agent_async, stream_agent, response_cache
+from context_builder import prompt_usage
+from state import session_store
+from db import pool_stats, close_pool
+from storage import start_janitor, stop_janitor, storage_stats
+import async_db
+import ann_index
+from utils import VECTOR_SEARCH_BACKEND, query_cache, embedding_batcher
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,6 +33,7 @@ app = FastAPI()
 app.include_router(voice_router)
 app.include_router(auth_router)
 app.include_router(img_router)  # ✅ Added to enable /upload
+app.include_router(diary_router)
 
 # ✅ Allow frontend CORS access
 origins = ["http://127.0.0.1:8000", "http://localhost:3000", "http://127.0.0.1:3000"]
@@ -28,6 +44,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # diary pagination
 )
 
 # ---------------- Models ----------------
@@ -44,18 +61,83 @@ class Feedback(BaseModel):
 
 # ---------------- Routes ----------------
 @app.post("/chat")
-async def chat_endpoint(query: Query):
+async def chat_endpoint(query: Query, user_id: int = Depends(get_current_user)):
     try:
-        answer = await run_in_threadpool(ask_agent, query.question, query.session_id)  # ✅ fixed argument order
+        answer = await ask_agent_async(query.session_id, query.question)
         return {"reply": answer, "from_db": True, "session_id": query.session_id}
     except Exception as e:
         print(f"❌ ERROR in /chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(query: Query, request: Request, user_id: int = Depends(get_current_user)):
+    """Server-Sent Events: one `data: {"token": ...}` event per chunk, then `event: done`."""
+    async def events():
+        async with aclosing(stream_agent(query.session_id, query.question)) as tokens:
+            async for token in tokens:
+                if await request.is_disconnected():
+                    return  # closing the generator cancels the upstream LLM call
+                yield f"data: {json.dumps({'token': token})}\n\n"
+        yield f"event: done\ndata: {json.dumps({'session_id': query.session_id})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/feedback")
-async def feedback_endpoint(feedback: Feedback):
-    if feedback.session_id not in feedback_store:
-        feedback_store[feedback.session_id] = {}
-    feedback_store[feedback.session_id][feedback.message_index] = feedback.rating
+async def feedback_endpoint(feedback: Feedback, user_id: int = Depends(get_current_user)):
+    if session_store.needs_load(feedback.session_id):
+        await run_in_threadpool(session_store.ensure_loaded, feedback.session_id)
+    session_store.record_feedback(feedback.session_id, feedback.message_index, feedback.rating)
     return {"status": "feedback recorded"}
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "db_pool": pool_stats(),
+        "async_db_pool": async_db.pool_stats(),
+        "query_cache": query_cache.stats(),
+        "embedding_batcher": embedding_batcher.stats(),
+        "response_cache": response_cache.stats(),
+        "prompt_tokens": prompt_usage.stats(),
+        "session_store": session_store.stats(),
+        "ocr": ocr_stats(),
+        "tts_cache": tts_cache.stats(),
+        "storage": await run_in_threadpool(storage_stats),
+        "password_hasher": password_hasher.stats(),
+        "token_revocations": revocations.stats(),
+        "diary_embedder": diary_embedder.stats(),
+        "retrieval": retrieval.retrieval_stats(),
+    }
+
+
+@app.on_event("startup")
+async def startup():
+    await async_db.init_pool()
+    session_store.start()
+    start_janitor()
+    diary_embedder.start()
+    # canned replies are synthesized in the background; startup doesn't wait on gTTS
+    app.state.tts_prerender = asyncio.create_task(prerender_canned_replies())
+    if VECTOR_SEARCH_BACKEND == "ann":
+        await run_in_threadpool(ann_index.load)
+        ann_index.start_background_refresh()
+    # BM25 index (hybrid retrieval) and, if configured, the re-ranking cross-encoder
+    await run_in_threadpool(retrieval.warm_up)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await run_in_threadpool(session_store.close)
+    shutdown_ocr_executor()
+    await close_chat_client()
+    await stop_janitor()
+    await diary_embedder.close()
+    password_hasher.shutdown()
+    await async_db.close_pool()
+    close_pool()
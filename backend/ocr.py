@@ -0,0 +1,206 @@
+# ocr.py
+# Text extraction for uploaded media (images, videos, PDFs).
+# Kept free of the web app / agent imports so it can run in the OCR worker
+# processes (see img.py) without loading the chat stack there.
+import os
+import re
+import time
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+
+# Video OCR: "multi" samples frames across the clip, "single" only reads the middle frame
+VIDEO_OCR_MODE = os.getenv("VIDEO_OCR_MODE", "multi")
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", 1.0))
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", 300))  # sampled frames considered at most
+VIDEO_DUPLICATE_DISTANCE = int(os.getenv("VIDEO_DUPLICATE_DISTANCE", 6))  # dHash bits; <= this = same frame
+VIDEO_OCR_BATCH = int(os.getenv("VIDEO_OCR_BATCH", 8))
+VIDEO_CPU_BUDGET = float(os.getenv("VIDEO_CPU_BUDGET", 30.0))  # CPU seconds per video
+
+# Scanned PDFs: pages without a text layer are rasterized and OCR'd
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", 200))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 50))  # pages read per document
+PDF_MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", 20))  # fewer extractable chars = scanned page
+
+_reader = None
+
+
+def get_reader():
+    """EasyOCR reader, created once per process."""
+    global _reader
+    if _reader is None:
+        import easyocr
+        _reader = easyocr.Reader(['en'], gpu=False)
+    return _reader
+
+
+def init_worker():
+    # load the OCR model up front so the first job in each worker isn't slow
+    get_reader()
+
+
+def ocr_array(image: np.ndarray) -> str:
+    """OCR an already-decoded RGB image (frame, page raster, ...) without touching disk."""
+    results = get_reader().readtext(image, detail=0)
+    return " ".join(results) if results else ""
+
+
+def dhash(frame: np.ndarray, size: int = 8) -> int:
+    """64-bit difference hash: cheap perceptual fingerprint for spotting repeated frames."""
+    small = np.asarray(Image.fromarray(frame).convert("L").resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def _coarse_to_fine(n: int):
+    """Indices 0..n-1 ordered so any prefix is spread evenly over the clip (middle, quarters, eighths, ...)."""
+    order, seen, step = [], set(), n
+    while step >= 1:
+        for i in range(step // 2, n, max(step, 1)):
+            if i not in seen:
+                seen.add(i)
+                order.append(i)
+        step //= 2
+    order.extend(i for i in range(n) if i not in seen)
+    return order
+
+
+def merge_lines(texts):
+    """Join OCR output from several frames, dropping lines already seen (case/space-insensitive)."""
+    seen, merged = set(), []
+    for text in texts:
+        for line in text:
+            key = re.sub(r"\s+", " ", line).strip().lower()
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(line.strip())
+    return "\n".join(merged)
+
+
+def read_video(video_path: str, sample_fps: float = VIDEO_SAMPLE_FPS, cpu_budget: float = VIDEO_CPU_BUDGET):
+    """
+    Sample frames at `sample_fps`, skip near-duplicates by dHash, and OCR the survivors
+    in batches. Frames are visited coarse-to-fine, so if the CPU budget runs out the
+    text read so far still covers the whole clip evenly.
+    Returns (text, {"decode": s, "ocr": s}).
+    """
+    import moviepy.editor as mp
+
+    timings = {"decode": 0.0, "ocr": 0.0}
+    cpu_start = time.process_time()
+    clip = mp.VideoFileClip(video_path)
+    try:
+        if VIDEO_OCR_MODE == "single":
+            start = time.perf_counter()
+            frame = clip.get_frame(clip.duration / 2)
+            timings["decode"] = time.perf_counter() - start
+            start = time.perf_counter()
+            text = ocr_array(frame)
+            timings["ocr"] = time.perf_counter() - start
+            return text, timings
+
+        count = max(1, min(int(clip.duration * sample_fps), VIDEO_MAX_FRAMES))
+        timestamps = [clip.duration * (i + 0.5) / count for i in range(count)]
+
+        kept_hashes, batch, results = [], [], []  # results: (timestamp, [lines])
+        sampled = skipped = 0
+        exhausted = False
+
+        def ocr_batch():
+            start = time.perf_counter()
+            lines = get_reader().readtext_batched([frame for _, frame in batch], detail=0)
+            timings["ocr"] += time.perf_counter() - start
+            results.extend((ts, frame_lines) for (ts, _), frame_lines in zip(batch, lines))
+            batch.clear()
+
+        for i in _coarse_to_fine(count):
+            if results and time.process_time() - cpu_start > cpu_budget:
+                exhausted = True
+                break
+            start = time.perf_counter()
+            frame = clip.get_frame(timestamps[i])
+            fingerprint = dhash(frame)
+            timings["decode"] += time.perf_counter() - start
+            sampled += 1
+            if any(bin(fingerprint ^ h).count("1") <= VIDEO_DUPLICATE_DISTANCE for h in kept_hashes):
+                skipped += 1
+                continue
+            kept_hashes.append(fingerprint)
+            batch.append((timestamps[i], frame))
+            if len(batch) >= VIDEO_OCR_BATCH or not results:
+                ocr_batch()
+        if batch and not exhausted:
+            ocr_batch()
+    finally:
+        clip.close()
+
+    print(f"[DEBUG] Video OCR: {sampled}/{count} frames sampled, {skipped} near-duplicates skipped, "
+          f"{len(results)} OCR'd{' (CPU budget exhausted)' if exhausted else ''}")
+    results.sort(key=lambda r: r[0])
+    return merge_lines(lines for _, lines in results), timings
+
+
+def pdf_text_layer(pdf_path: str, max_pages: int = PDF_MAX_PAGES):
+    """
+    Read the text layer of the first `max_pages` pages.
+    Returns (page texts, indexes of pages that need OCR, total page count).
+    """
+    texts, scanned = [], []
+    with fitz.open(pdf_path) as doc:
+        total = doc.page_count
+        for index in range(min(total, max_pages)):
+            text = doc[index].get_text("text").strip()
+            texts.append(text)
+            if len(text) < PDF_MIN_TEXT_CHARS:
+                scanned.append(index)
+    return texts, scanned, total
+
+
+def ocr_pdf_page(pdf_path: str, index: int, dpi: int = PDF_OCR_DPI):
+    """Rasterize one page in memory and OCR it. Returns (index, text, {"decode": s, "ocr": s})."""
+    start = time.perf_counter()
+    with fitz.open(pdf_path) as doc:
+        pix = doc[index].get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False)
+        image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+    decode = time.perf_counter() - start
+    start = time.perf_counter()
+    text = ocr_array(image)
+    return index, text, {"decode": decode, "ocr": time.perf_counter() - start}
+
+
+def join_pages(texts) -> str:
+    return "\n".join(t for t in texts if t).strip()
+
+
+def extract(media_type: str, path: str):
+    """
+    Worker entry point: (text, {"decode": s, "ocr": s}, ok). `ok` is False if
+    decoding or OCR failed (text is then "" or partial).
+    Decoding (image load / frame grab) is timed separately from OCR.
+    PDFs don't come through here: img.py runs pdf_text_layer and ocr_pdf_page as separate pool jobs.
+    """
+    timings = {"decode": 0.0, "ocr": 0.0}
+    start = time.perf_counter()
+    text, ok = "", True
+    if media_type == "image":
+        try:
+            image = np.asarray(Image.open(path).convert("RGB"))
+        except Exception as e:
+            print(f"Image decode error: {e}")
+            return "", timings, False
+        timings["decode"] = time.perf_counter() - start
+        start = time.perf_counter()
+        try:
+            text = ocr_array(image)
+        except Exception as e:
+            print(f"Image OCR error: {e}")
+            ok = False
+        timings["ocr"] = time.perf_counter() - start
+    elif media_type == "video":
+        try:
+            text, timings = read_video(path)
+        except Exception as e:
+            print(f"Video OCR error: {e}")
+            ok = False
+    return text, timings, ok
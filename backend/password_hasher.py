@@ -0,0 +1,94 @@
+# password_hasher.py
+# bcrypt on its own bounded thread pool, so a signup/login burst can't take
+# over the shared threadpool that /chat and friends use.
+#
+# - HASH_WORKERS threads (default: one per core); bcrypt releases the GIL.
+# - At most HASH_WORKERS + HASH_MAX_QUEUE hashes in flight; beyond that callers
+#   get a 503 with Retry-After instead of piling up.
+# - Queue time (submit -> start on a worker) is tracked for /metrics.
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 2))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", 4 * HASH_WORKERS))
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = HASH_WORKERS, max_queue: int = HASH_MAX_QUEUE, rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.max_jobs = workers + max_queue
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._jobs = 0  # running + queued, only touched from the event loop
+        self._lock = threading.Lock()
+
+        self.completed = 0
+        self.rejected = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(self.rounds))
+        return hashed.decode("utf-8")
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(bcrypt.checkpw, password.encode("utf-8"), password_hash.encode("utf-8"))
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """True if the hash was made with a different cost factor than BCRYPT_ROUNDS."""
+        try:
+            return int(password_hash.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def has_capacity(self) -> bool:
+        return self._jobs < self.max_jobs
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "jobs": self._jobs,
+                "max_jobs": self.max_jobs,
+                "rounds": self.rounds,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_queue_ms": round(self.queue_time_total / self.completed * 1000, 2) if self.completed else 0.0,
+                "max_queue_ms": round(self.queue_time_max * 1000, 2),
+            }
+
+    async def _run(self, fn, *args):
+        if self._jobs >= self.max_jobs:
+            with self._lock:
+                self.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many sign-in requests, please retry shortly",
+                                headers={"Retry-After": "2"})
+        self._jobs += 1
+        submitted = time.perf_counter()
+
+        def timed():
+            waited = time.perf_counter() - submitted
+            with self._lock:
+                self.completed += 1
+                self.queue_time_total += waited
+                self.queue_time_max = max(self.queue_time_max, waited)
+            return fn(*args)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._jobs -= 1
+
+
+password_hasher = PasswordHasher()
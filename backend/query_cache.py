@@ -0,0 +1,137 @@
+# query_cache.py
+# Bounded LRU + TTL cache for knowledge-base lookups, keyed on normalized query text.
+#
+# Each entry keeps the query embedding and the top-k (id, content, distance) rows.
+# Rows are tagged with the embeddings-table version they were computed against;
+# when the table changes the rows are dropped but the embedding is kept
+# (MiniLM output for the same text never changes).
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 3600))  # seconds
+# how often (seconds) to ask Postgres whether mental_health_embeddings changed
+QUERY_CACHE_VERSION_CHECK = float(os.getenv("QUERY_CACHE_VERSION_CHECK", 30))
+
+_PUNCTUATION_EDGES = re.compile(r"^[\W_]+|[\W_]+$")
+
+
+def normalize_query(query: str) -> str:
+    """'  Meltdowns?? ' and 'meltdowns' share a cache entry."""
+    return _PUNCTUATION_EDGES.sub("", " ".join(query.lower().split()))
+
+
+class _Entry:
+    __slots__ = ("vector", "rows", "version", "created")
+
+    def __init__(self, vector, created):
+        self.vector = vector
+        self.rows = None
+        self.version = None
+        self.created = created
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # table version bookkeeping
+        self.version = None
+        self._version_checked = 0.0
+
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+        self.result_hits = 0
+        self.result_misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _lookup(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created > self.ttl:
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_embedding(self, key: str):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None or entry.vector is None:
+                self.embedding_misses += 1
+                return None
+            self.embedding_hits += 1
+            return entry.vector
+
+    def put_embedding(self, key: str, vector):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key].vector = vector
+                self._entries.move_to_end(key)
+                return
+            self._insert(key, _Entry(vector, time.monotonic()))
+
+    def get_results(self, key: str, version):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None or entry.rows is None:
+                self.result_misses += 1
+                return None
+            if entry.version != version:
+                entry.rows, entry.version = None, None
+                self.invalidations += 1
+                self.result_misses += 1
+                return None
+            self.result_hits += 1
+            return entry.rows
+
+    def put_results(self, key: str, version, rows):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:  # a results-only key (no embedding stored under it)
+                entry = _Entry(None, time.monotonic())
+                self._insert(key, entry)
+            entry.rows, entry.version = list(rows), version
+
+    def _insert(self, key: str, entry: _Entry):
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def version_check_due(self) -> bool:
+        return time.monotonic() - self._version_checked >= QUERY_CACHE_VERSION_CHECK
+
+    def set_version(self, version):
+        self.version = version
+        self._version_checked = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.result_hits + self.result_misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "embedding_hits": self.embedding_hits,
+                "embedding_misses": self.embedding_misses,
+                "result_hits": self.result_hits,
+                "result_misses": self.result_misses,
+                "result_hit_rate": round(self.result_hits / lookups, 3) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
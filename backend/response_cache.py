@@ -0,0 +1,118 @@
+# response_cache.py
+# Semantic cache in front of the chat LLM.
+#
+# A past answer is reused when a new query's embedding is within
+# RESPONSE_CACHE_THRESHOLD cosine similarity of a cached query AND retrieval
+# returned exactly the same chunk set. Only used for sessions with little or no
+# history (RESPONSE_CACHE_MAX_HISTORY messages), where the answer doesn't
+# depend on the conversation so far.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 512))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 6 * 3600))  # seconds
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95))  # cosine similarity
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RESPONSE_CACHE_MAX_HISTORY", 0))  # messages already in the session
+
+
+class _Entry:
+    __slots__ = ("vector", "chunk_ids", "reply", "latency", "created")
+
+    def __init__(self, vector, chunk_ids, reply, latency):
+        self.vector = vector
+        self.chunk_ids = chunk_ids
+        self.reply = reply
+        self.latency = latency
+        self.created = time.monotonic()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 threshold: float = RESPONSE_CACHE_THRESHOLD, max_history: int = RESPONSE_CACHE_MAX_HISTORY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_history = max_history
+        self._entries = OrderedDict()
+        self._ids = count()
+        self._lock = threading.Lock()
+        # stacked vectors of all entries, rebuilt lazily after inserts/evictions
+        self._matrix = None
+        self._matrix_keys = []
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_latency = 0.0
+
+    def applies(self, history_len: int) -> bool:
+        if history_len > self.max_history:
+            with self._lock:
+                self.bypassed += 1
+            return False
+        return True
+
+    def lookup(self, query_vector, chunk_ids):
+        """Cached reply for a near-identical query over the same chunks, or None."""
+        q = _normalize(query_vector)
+        wanted = frozenset(chunk_ids)
+        with self._lock:
+            self._expire()
+            matrix, keys = self._stacked()
+            if matrix is not None:
+                sims = matrix @ q
+                for i in np.argsort(-sims):
+                    if sims[i] < self.threshold:
+                        break
+                    entry = self._entries[keys[i]]
+                    if entry.chunk_ids == wanted:
+                        self._entries.move_to_end(keys[i])
+                        self.hits += 1
+                        self.saved_latency += entry.latency
+                        return entry.reply
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, chunk_ids, reply: str, latency: float):
+        with self._lock:
+            self._entries[next(self._ids)] = _Entry(_normalize(query_vector), frozenset(chunk_ids), reply, latency)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "saved_calls": self.hits,
+                "saved_latency_s": round(self.saved_latency, 2),
+            }
+
+    def _expire(self):
+        now = time.monotonic()
+        stale = [k for k, e in self._entries.items() if now - e.created > self.ttl]
+        for key in stale:
+            del self._entries[key]
+            self._matrix = None
+
+    def _stacked(self):
+        if self._matrix is None and self._entries:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[k].vector for k in self._matrix_keys])
+        return self._matrix, self._matrix_keys
+
+
+def _normalize(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    return v / max(float(np.linalg.norm(v)), 1e-12)
@@ -0,0 +1,297 @@
+# retrieval.py
+# Hybrid knowledge-base retrieval for the chat agent.
+#
+# - Dense: the existing MiniLM vector search (pgvector or ann_index).
+# - Sparse: an in-memory BM25 index over the same chunks, so exact terms
+#   ("ADHD IEP 504", medication names) that embeddings blur still match.
+# - Both run concurrently and are merged with reciprocal rank fusion (RRF):
+#   score = sum over retrievers of 1 / (RRF_K + rank).
+# - Optionally a small CPU cross-encoder re-orders the top RERANK_POOL fused
+#   candidates. It gets RERANK_BUDGET_MS; if it can't finish in time the fused
+#   order is used as-is. Re-ranks run one at a time and are skipped while one is
+#   still running, so no request spends its budget waiting in a queue.
+# Per-stage timings are written into the caller's `timings` dict and averaged
+# in retrieval_stats() for /metrics.
+
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+import async_db
+from db import get_connection
+from query_cache import normalize_query
+from utils import query_cache, TOP_K, embeddings_version
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")  # "hybrid" or "dense"
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", 30))  # per retriever, before fusion
+RRF_K = int(os.getenv("RRF_K", 60))
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")  # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2; empty = off
+RERANK_POOL = int(os.getenv("RERANK_POOL", 20))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 150))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i in is it its my of on or that the their them they "
+    "this to was what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inverted index with BM25 weights precomputed per posting, so a query is
+    one numpy scatter-add per query term.
+    """
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.contents: List[str] = []
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.version = None
+
+    def __len__(self):
+        return len(self.contents)
+
+    def build(self, ids, contents: List[str], version=None):
+        lengths = []
+        term_docs = defaultdict(list)
+        term_freqs = defaultdict(list)
+        for doc, text in enumerate(contents):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_docs[term].append(doc)
+                term_freqs[term].append(tf)
+
+        n = len(contents)
+        lengths = np.asarray(lengths, dtype=np.float32)
+        avg_len = float(lengths.mean()) if n else 0.0
+        postings = {}
+        for term, docs in term_docs.items():
+            docs = np.asarray(docs, dtype=np.int32)
+            tf = np.asarray(term_freqs[term], dtype=np.float32)
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / max(avg_len, 1e-6))
+            postings[term] = (docs, (idf * tf * (BM25_K1 + 1) / (tf + norm)).astype(np.float32))
+
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.contents = list(contents)
+        self._postings = postings
+        self.version = version
+
+    def search(self, query: str, k: int) -> List[Tuple[int, str, float]]:
+        """(id, content, bm25 score) for the best `k` chunks containing any query term."""
+        terms = [t for t in set(tokenize(query)) if t in self._postings]
+        if not terms:
+            return []
+        scores = np.zeros(len(self.contents), dtype=np.float32)
+        for term in terms:
+            docs, weights = self._postings[term]
+            scores[docs] += weights
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(int(self.ids[i]), self.contents[i], float(scores[i])) for i in matched]
+
+
+# ---------------- sparse index lifecycle ----------------
+bm25 = BM25Index()
+_bm25_lock = threading.Lock()  # one (re)build at a time
+
+
+def load_bm25(version=None):
+    """(Re)build the BM25 index from mental_health_embeddings (blocking)."""
+    global bm25
+    with _bm25_lock:
+        if version is not None and bm25.version == version:
+            return
+        start = time.perf_counter()
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT id, content FROM mental_health_embeddings ORDER BY id")
+            rows = cur.fetchall()
+        index = BM25Index()
+        index.build([r[0] for r in rows], [r[1] for r in rows], version)
+        bm25 = index  # swapped in whole; searches in flight keep the old one
+        print(f"✅ BM25 index loaded: {len(rows)} chunks in {time.perf_counter() - start:.1f}s")
+
+
+def _refresh_bm25(version):
+    """Rebuild in the background when the embeddings table changed; searches use the old index meanwhile."""
+    if bm25.version != version and not _bm25_lock.locked():
+        def run():
+            try:
+                load_bm25(version)
+            except Exception as e:
+                print(f"❌ BM25 index refresh failed: {e}")
+        threading.Thread(target=run, name="bm25-refresh", daemon=True).start()
+
+
+# ---------------- re-ranking ----------------
+_reranker = None
+_rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+_rerank_job = None  # last submitted re-rank (event loop only); a new one starts only once it's done
+
+
+def get_reranker():
+    global _reranker
+    if _reranker is None:
+        from sentence_transformers import CrossEncoder
+        _reranker = CrossEncoder(RERANK_MODEL, device="cpu")
+    return _reranker
+
+
+def _rerank(query: str, rows):
+    scores = get_reranker().predict([(query, row[1]) for row in rows])
+    order = np.argsort(-np.asarray(scores))
+    return [(rows[i][0], rows[i][1], float(scores[i])) for i in order]
+
+
+def warm_up():
+    """Load the sparse index and the cross-encoder before the first request (blocking)."""
+    if RETRIEVAL_MODE == "hybrid":
+        load_bm25(embeddings_version())
+    if RERANK_MODEL:
+        get_reranker()
+
+
+# ---------------- retrieval ----------------
+def reciprocal_rank_fusion(*rankings, k: int = RRF_K) -> List[Tuple[int, str, float]]:
+    scores, contents = defaultdict(float), {}
+    for ranking in rankings:
+        for rank, (chunk_id, content, _) in enumerate(ranking, 1):
+            scores[chunk_id] += 1.0 / (k + rank)
+            contents[chunk_id] = content
+    return [(cid, contents[cid], score) for cid, score in sorted(scores.items(), key=lambda x: -x[1])]
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.reranked = 0
+        self.rerank_timeouts = 0
+        self.rerank_skipped = 0
+
+    def count(self, name: str):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record(self, timings: dict):
+        with self.lock:
+            self.queries += 1
+            for stage, seconds in timings.items():
+                self.totals[stage] += seconds
+                self.counts[stage] += 1
+
+
+_stats = _Stats()
+
+
+async def retrieve(query: str, k: int = TOP_K, timings: Optional[dict] = None,
+                   query_vector=None) -> List[Tuple[int, str, float]]:
+    """
+    Best `k` chunks as (id, content, score) for a query, uncached.
+    Fills timings["retrieve_dense" / "retrieve_sparse" / "retrieve_fuse" / "retrieve_rerank"] (seconds).
+    """
+    stage = {}
+    # dense-only without re-ranking has nothing to fuse, so don't over-fetch
+    candidates = max(RETRIEVAL_CANDIDATES, k) if RETRIEVAL_MODE == "hybrid" or RERANK_MODEL else k
+
+    async def dense():
+        start = time.perf_counter()
+        vector = query_vector if query_vector is not None else await async_db.encode_query(query)
+        rows = await async_db.search_vector(vector, candidates)
+        stage["retrieve_dense"] = time.perf_counter() - start
+        return rows
+
+    async def sparse():
+        if RETRIEVAL_MODE != "hybrid" or not len(bm25):
+            return []
+        start = time.perf_counter()
+        rows = await run_in_threadpool(bm25.search, query, candidates)
+        stage["retrieve_sparse"] = time.perf_counter() - start
+        return rows
+
+    dense_rows, sparse_rows = await asyncio.gather(dense(), sparse())
+
+    start = time.perf_counter()
+    fused = reciprocal_rank_fusion(dense_rows, sparse_rows) if sparse_rows else list(dense_rows)
+    stage["retrieve_fuse"] = time.perf_counter() - start
+
+    global _rerank_job
+    if RERANK_MODEL and len(fused) > 1:
+        if _rerank_job is not None and not _rerank_job.done():
+            _stats.count("rerank_skipped")  # the worker is busy (e.g. an over-budget job); fused order it is
+        else:
+            start = time.perf_counter()
+            pool = fused[:max(RERANK_POOL, k)]
+            _rerank_job = job = asyncio.get_running_loop().run_in_executor(_rerank_executor, _rerank, query, pool)
+            job.add_done_callback(lambda f: f.cancelled() or f.exception())  # errors after a timeout aren't logged as unretrieved
+            try:
+                # shield: on timeout the job keeps running (and blocks new ones) instead of being cancelled
+                fused = await asyncio.wait_for(asyncio.shield(job), RERANK_BUDGET_MS / 1000)
+                _stats.count("reranked")
+            except asyncio.TimeoutError:
+                _stats.count("rerank_timeouts")  # finishes in the background; its result is dropped
+            stage["retrieve_rerank"] = time.perf_counter() - start
+
+    _stats.record(stage)
+    if timings is not None:
+        timings.update(stage)
+    return fused[:k]
+
+
+def _results_key(key: str) -> str:
+    # The bare normalized query holds the embedding and utils.search_rows' dense-only
+    # rows; these rows depend on the mode and re-ranker too. Normalized queries never
+    # start with punctuation, so the prefix can't collide with one.
+    return f"#{RETRIEVAL_MODE}|{RERANK_MODEL}|{key}"
+
+
+async def search_rows(query: str, timings: Optional[dict] = None) -> List[tuple]:
+    """
+    TOP_K (id, content, score) rows for the chat agent, cached per normalized
+    query (and retrieval configuration) until the embeddings table changes.
+    """
+    key = normalize_query(query)
+    results_key = _results_key(key)
+    version = await async_db.embeddings_version()
+    if RETRIEVAL_MODE == "hybrid":
+        _refresh_bm25(version)
+    rows = query_cache.get_results(results_key, version)
+    if rows is None:
+        query_vector = await async_db.encode_query(query, key)
+        rows = await retrieve(query, TOP_K, timings, query_vector)
+        query_cache.put_results(results_key, version, rows)
+    return rows
+
+
+def retrieval_stats():
+    with _stats.lock:
+        return {
+            "mode": RETRIEVAL_MODE,
+            "bm25_chunks": len(bm25),
+            "rerank_model": RERANK_MODEL or None,
+            "queries": _stats.queries,
+            "avg_ms": {stage: round(total / _stats.counts[stage] * 1000, 2) for stage, total in _stats.totals.items()},
+            "reranked": _stats.reranked,
+            "rerank_timeouts": _stats.rerank_timeouts,
+            "rerank_skipped": _stats.rerank_skipped,
+        }
@@ -0,0 +1,319 @@
+# session_store.py
+# Chat history + feedback, with a bounded in-memory hot tier in front of the
+# chat_sessions / feedback tables.
+#
+# - Writes go to memory immediately and are queued; a background thread flushes
+#   the queue to Postgres in batches (write-behind), not one INSERT per message.
+# - Sessions idle for SESSION_IDLE_TTL seconds, or the least recently used ones
+#   once SESSION_STORE_MAX_SESSIONS / SESSION_STORE_MAX_BYTES is exceeded, are
+#   dropped from memory and lazily reloaded from Postgres on next access.
+# - With several workers a session can be hot in more than one of them. Unless
+#   SESSION_STORE_VALIDATE=0 (single worker, or sticky routing by session), each
+#   request compares the session's row counts in Postgres with what this worker
+#   has seen and reloads it if another worker wrote to it.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+from psycopg2.extras import execute_values
+
+from db import get_connection
+
+SESSION_STORE_MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", 5000))
+SESSION_STORE_MAX_BYTES = int(os.getenv("SESSION_STORE_MAX_BYTES", 64 * 1024 * 1024))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", 1800))  # seconds
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", 2))  # seconds
+SESSION_FLUSH_BATCH = int(os.getenv("SESSION_FLUSH_BATCH", 500))  # flush early once this many writes are queued
+
+SESSION_STORE_VALIDATE = os.getenv("SESSION_STORE_VALIDATE", "1") == "1"
+SESSION_LOAD_RETRIES = 3  # consistent reads attempted around concurrent flushes before waiting one out
+
+MESSAGE_OVERHEAD_BYTES = 120  # rough per-message cost of the dict + strings
+
+
+class _Session:
+    __slots__ = ("messages", "feedback", "feedback_rows", "summary", "summarized", "last_access", "bytes")
+
+    def __init__(self, messages, feedback, feedback_rows):
+        self.messages = messages
+        self.feedback = feedback
+        self.feedback_rows = feedback_rows  # ratings recorded, incl. overwritten ones (= feedback table rows)
+        self.summary = ""    # rolling summary of older turns (context_builder)
+        self.summarized = 0  # messages covered by `summary`
+        self.last_access = time.monotonic()
+        self.bytes = sum(_message_bytes(m["content"]) for m in messages)
+
+
+def _message_bytes(content: str) -> int:
+    return len(content) + MESSAGE_OVERHEAD_BYTES
+
+
+class SessionStore:
+    def __init__(self):
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._bytes = 0
+
+        # write-behind queues; `_inflight` holds the batch currently being written
+        self._pending_messages = []
+        self._pending_feedback = []
+        self._inflight_messages = []
+        self._inflight_feedback = []
+        self._flush_lock = threading.Lock()
+        self._flush_batches = 0  # batches moved to `_inflight`; lets a load detect a flush during its read
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.rehydrations = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+
+    # ---------------- reads ----------------
+    def is_hot(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def needs_load(self, session_id: str) -> bool:
+        """Whether ensure_loaded may hit Postgres (cold session, or hot ones are validated)."""
+        return SESSION_STORE_VALIDATE or session_id not in self._sessions
+
+    def ensure_loaded(self, session_id: str):
+        """
+        Load a session from Postgres if it isn't in memory, or reload it if another
+        worker wrote to it (blocking DB call). Called once per request.
+        """
+        if SESSION_STORE_VALIDATE and session_id in self._sessions and self._stale(session_id):
+            with self._lock:
+                session = self._sessions.pop(session_id, None)
+                if session is not None:
+                    self._bytes -= session.bytes
+                    self.invalidations += 1
+        with self._hot(session_id):
+            pass
+
+    def messages(self, session_id: str) -> List[dict]:
+        with self._hot(session_id) as session:
+            return list(session.messages)
+
+    def history_len(self, session_id: str) -> int:
+        with self._hot(session_id) as session:
+            return len(session.messages)
+
+    def feedback(self, session_id: str) -> Dict[int, int]:
+        with self._hot(session_id) as session:
+            return dict(session.feedback)
+
+    # ---------------- writes ----------------
+    def append(self, session_id: str, role: str, content: str):
+        with self._hot(session_id) as session:
+            session.messages.append({"role": role, "content": content})
+            size = _message_bytes(content)
+            session.bytes += size
+            self._bytes += size
+            self._pending_messages.append((session_id, role, content, datetime.now()))
+            self._enforce_bounds(keep=session_id)
+            if len(self._pending_messages) >= SESSION_FLUSH_BATCH:
+                self._wakeup.set()
+
+    def record_feedback(self, session_id: str, message_index: int, rating: int):
+        with self._hot(session_id) as session:
+            session.feedback[message_index] = rating
+            session.feedback_rows += 1
+            self._pending_feedback.append((session_id, message_index, rating, datetime.now()))
+
+    def summary(self, session_id: str):
+        """(rolling summary, number of messages it covers); rebuilt on demand after a rehydrate."""
+        with self._hot(session_id) as session:
+            return session.summary, session.summarized
+
+    def set_summary(self, session_id: str, summary: str, summarized: int):
+        with self._hot(session_id) as session:
+            session.summary, session.summarized = summary, summarized
+
+    # ---------------- background flushing ----------------
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="session-store-flush", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the flusher and write everything still queued."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                self._inflight_messages, self._pending_messages = self._pending_messages, []
+                self._inflight_feedback, self._pending_feedback = self._pending_feedback, []
+                if self._inflight_messages or self._inflight_feedback:
+                    self._flush_batches += 1
+            if not self._inflight_messages and not self._inflight_feedback:
+                return
+            try:
+                with get_connection() as conn, conn.cursor() as cur:
+                    if self._inflight_messages:
+                        execute_values(
+                            cur,
+                            "INSERT INTO chat_sessions (session_id, role, content, created_at) VALUES %s",
+                            self._inflight_messages, page_size=500,
+                        )
+                    if self._inflight_feedback:
+                        execute_values(
+                            cur,
+                            "INSERT INTO feedback (session_id, message_index, rating, created_at) VALUES %s",
+                            self._inflight_feedback, page_size=500,
+                        )
+                self.flushes += 1
+                self.flushed_rows += len(self._inflight_messages) + len(self._inflight_feedback)
+            except Exception as e:
+                # put the batch back in front so nothing is lost; retried on the next flush
+                self.flush_errors += 1
+                print(f"❌ Session flush failed: {e}")
+                with self._lock:
+                    self._pending_messages[:0] = self._inflight_messages
+                    self._pending_feedback[:0] = self._inflight_feedback
+            finally:
+                with self._lock:
+                    self._inflight_messages, self._inflight_feedback = [], []
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - SESSION_IDLE_TTL
+        with self._lock:
+            idle = [sid for sid, s in self._sessions.items() if s.last_access < cutoff]
+            for sid in idle:
+                self._evict(sid)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": SESSION_STORE_MAX_SESSIONS,
+                "messages": sum(len(s.messages) for s in self._sessions.values()),
+                "bytes": self._bytes,
+                "max_bytes": SESSION_STORE_MAX_BYTES,
+                "pending_writes": len(self._pending_messages) + len(self._pending_feedback),
+                "flushes": self.flushes,
+                "flushed_rows": self.flushed_rows,
+                "flush_errors": self.flush_errors,
+                "rehydrations": self.rehydrations,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+    # ---------------- internals ----------------
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(SESSION_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+            self.evict_idle()
+
+    @contextmanager
+    def _hot(self, session_id: str):
+        """
+        Hold the store lock with the session in memory. A cold session is read
+        from Postgres first, without the store lock, so other sessions aren't blocked.
+        """
+        while True:
+            with self._lock:
+                session = self._sessions.get(session_id)
+                if session is not None:
+                    self._sessions.move_to_end(session_id)
+                    session.last_access = time.monotonic()
+                    yield session
+                    return
+            self._load(session_id)
+
+    def _load(self, session_id: str):
+        # A write is in Postgres or still queued, never both or neither, as long as
+        # no flush was in progress during the read; otherwise read again, and in the
+        # end wait for the flush to finish (the flush lock) rather than retry forever.
+        for attempt in range(SESSION_LOAD_RETRIES + 1):
+            if attempt < SESSION_LOAD_RETRIES:
+                with self._lock:
+                    flushing = bool(self._inflight_messages or self._inflight_feedback)
+                    batches = self._flush_batches
+                if flushing:
+                    continue
+                messages, feedback, feedback_rows = self._read(session_id)
+                with self._lock:
+                    if self._flush_batches == batches:
+                        self._insert(session_id, messages, feedback, feedback_rows)
+                        return
+            else:
+                with self._flush_lock:
+                    messages, feedback, feedback_rows = self._read(session_id)
+                    with self._lock:
+                        self._insert(session_id, messages, feedback, feedback_rows)
+
+    @staticmethod
+    def _read(session_id: str):
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT role, content FROM chat_sessions WHERE session_id = %s ORDER BY id", (session_id,))
+            messages = [{"role": role, "content": content} for role, content in cur.fetchall()]
+            cur.execute("SELECT message_index, rating FROM feedback WHERE session_id = %s ORDER BY id", (session_id,))
+            rows = cur.fetchall()
+        return messages, dict(rows), len(rows)
+
+    def _insert(self, session_id: str, messages, feedback, feedback_rows):
+        """Under self._lock, after a consistent read: add the queued writes and make the session hot."""
+        if session_id in self._sessions:
+            return  # loaded by another thread meanwhile
+        # writes for this session that haven't reached Postgres yet
+        for sid, role, content, _ in self._pending_messages:
+            if sid == session_id:
+                messages.append({"role": role, "content": content})
+        for sid, index, rating, _ in self._pending_feedback:
+            if sid == session_id:
+                feedback[index] = rating
+                feedback_rows += 1
+        session = self._sessions[session_id] = _Session(messages, feedback, feedback_rows)
+        self._bytes += session.bytes
+        self.rehydrations += 1
+        self._enforce_bounds(keep=session_id)
+
+    def _stale(self, session_id: str) -> bool:
+        """True if Postgres holds writes for a hot session that this worker hasn't seen."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            queued_messages = sum(1 for w in self._inflight_messages + self._pending_messages if w[0] == session_id)
+            queued_feedback = sum(1 for w in self._inflight_feedback + self._pending_feedback if w[0] == session_id)
+            expected = (len(session.messages) - queued_messages, session.feedback_rows - queued_feedback)
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT (SELECT count(*) FROM chat_sessions WHERE session_id = %s),
+                       (SELECT count(*) FROM feedback WHERE session_id = %s)
+            """, (session_id, session_id))
+            persisted = tuple(cur.fetchone())
+        # a flush of our own finishing in between also shows up as a mismatch; that only costs a reload
+        return persisted != expected
+
+    def _enforce_bounds(self, keep: str):
+        while (len(self._sessions) > SESSION_STORE_MAX_SESSIONS or self._bytes > SESSION_STORE_MAX_BYTES) \
+                and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._evict(oldest)
+
+    def _evict(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.bytes
+            self.evictions += 1
@@ -1,6 +1,6 @@
 # state.py
-from typing import Dict, List
+from session_store import SessionStore
 
-chat_sessions: Dict[str, List[dict]] = {}
-feedback_store: Dict[str, Dict[int, int]] = {}
-# chat_sessions structure: {session_id: [{"role": "user"/"assistant", "content": "..."}, ...]}
\ No newline at end of file
+# Chat history + feedback per session: {session_id: [{"role": "user"/"assistant", "content": "..."}, ...]}
+# Hot sessions live in memory, everything is persisted to chat_sessions / feedback (see session_store.py)
+session_store = SessionStore()
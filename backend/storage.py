@@ -0,0 +1,263 @@
+# storage.py
+# File storage for uploads and generated audio.
+#
+# - Uploads are written in chunks with a size cap, under content-addressed names
+#   (<sha256><ext>) so identical uploads share one file.
+# - Every directory we write to is a StorageArea with a byte quota (least
+#   recently used files are evicted first) and a TTL. Expired files are removed
+#   by a background janitor task started with the app.
+# - All accounting is read from the directory (mtime = last use), so it holds
+#   across several worker processes sharing it.
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # bytes read from the request per step
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_BYTES", 10 * 1024 * 1024))
+
+MB = 1024 * 1024
+STORAGE_JANITOR_INTERVAL = float(os.getenv("STORAGE_JANITOR_INTERVAL", 300))  # seconds
+PART_SUFFIX = ".part"  # temp files being written, renamed into place when complete
+PART_GRACE = float(os.getenv("STORAGE_PART_GRACE", 3600))  # seconds before an untouched temp file counts as abandoned
+
+_SAFE_EXTENSION = re.compile(r"^\.[a-z0-9]{1,8}$")
+
+
+def safe_extension(filename: str, default: str = "") -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if _SAFE_EXTENSION.match(ext) else default
+
+
+class StorageArea:
+    """
+    One directory with a byte quota (LRU eviction) and a TTL since last use.
+
+    The directory itself is the shared state: "last used" is the file's mtime
+    (bumped by touch()), and usage is summed from disk whenever the quota or TTL
+    is enforced, so several worker processes serving the same directory agree.
+    """
+
+    def __init__(self, name: str, directory: str, max_bytes: int, ttl: float):
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()  # one scan-and-evict at a time in this process
+
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.expired_files = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale_parts()
+        with self._lock:
+            self._enforce_quota(keep=None)
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def touch(self, filename: str) -> bool:
+        """Mark a file as used; False if the area doesn't hold it."""
+        try:
+            os.utime(self.path(filename))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def add(self, filename: str):
+        """Call after a file was written into the directory: enforces the quota, keeping that file."""
+        with self._lock:
+            self._enforce_quota(keep=filename)
+
+    def temp_file(self, suffix: str = PART_SUFFIX):
+        """(fd, path) of a fresh temp file in this area, to be renamed into place and add()-ed."""
+        return tempfile.mkstemp(dir=self.directory, suffix=suffix)
+
+    def write_bytes(self, filename: str, data: bytes) -> str:
+        """Atomically write `data` as `filename` (blocking)."""
+        fd, tmp_path = self.temp_file()
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            os.replace(tmp_path, self.path(filename))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.add(filename)
+        return self.path(filename)
+
+    def expire(self):
+        """Delete files not used for `ttl` seconds and abandoned temp files (blocking; run by the janitor)."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for used, name, _ in self._files():
+                if used < cutoff and self._remove(name):
+                    self.expired_files += 1
+        self._remove_stale_parts()
+
+    def stats(self):
+        files = self._files()
+        return {
+            "directory": self.directory,
+            "files": len(files),
+            "bytes": sum(size for _, _, size in files),
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl,
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+            "expired_files": self.expired_files,
+        }
+
+    def _files(self):
+        """(last used, name, size) of every finished file on disk, least recently used first."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(PART_SUFFIX):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:  # removed by another worker meanwhile
+                continue
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+        files.sort()
+        return files
+
+    def _remove_stale_parts(self):
+        """
+        Drop temp files left by interrupted writes. Only ones untouched for
+        PART_GRACE seconds: a younger one may be an upload another worker is still writing.
+        """
+        cutoff = time.time() - PART_GRACE
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(PART_SUFFIX):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _enforce_quota(self, keep):
+        files = self._files()
+        used = sum(size for _, _, size in files)
+        for _, name, size in files:
+            if used <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            used -= size
+            if self._remove(name):
+                self.evicted_bytes += size
+                self.evicted_files += 1
+
+    def _remove(self, filename: str) -> bool:
+        try:
+            os.remove(self.path(filename))
+        except FileNotFoundError:
+            return False  # another worker got there first
+        return True
+
+
+uploads = StorageArea(
+    "uploads", "uploaded_media",
+    int(os.getenv("UPLOADS_MAX_BYTES", 2048 * MB)), float(os.getenv("UPLOADS_TTL", 24 * 3600)),
+)
+voice_uploads = StorageArea(
+    "voice_uploads", "temp_audio",
+    int(os.getenv("VOICE_UPLOADS_MAX_BYTES", 512 * MB)), float(os.getenv("VOICE_UPLOADS_TTL", 3600)),
+)
+tts_audio = StorageArea(
+    "tts_audio", os.getenv("TTS_CACHE_DIR", os.path.join("temp_audio", "tts")),
+    int(os.getenv("TTS_CACHE_MAX_BYTES", 200 * MB)), float(os.getenv("TTS_CACHE_TTL", 7 * 24 * 3600)),
+)
+AREAS = [uploads, voice_uploads, tts_audio]
+
+
+def _place_upload(area: StorageArea, tmp_path: str, filename: str):
+    """Move a finished upload into place, or drop it if the area already holds the same content (blocking)."""
+    if area.touch(filename):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, area.path(filename))
+        area.add(filename)
+
+
+async def save_upload(upload: UploadFile, area: StorageArea, max_bytes: int = MAX_UPLOAD_BYTES,
+                      default_extension: str = ""):
+    """
+    Stream an upload into `area` in UPLOAD_CHUNK_SIZE pieces, hashing as we go.
+    Raises 413 once more than `max_bytes` arrive. Returns (path, sha256, size);
+    the file is stored as <sha256><ext>, so re-uploads of the same content reuse it.
+    """
+    fd, tmp_path = area.temp_file()
+    os.close(fd)
+    digest, size = hashlib.sha256(), 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"File too large (limit {max_bytes // MB} MB)")
+                digest.update(chunk)
+                await out.write(chunk)
+
+        content_hash = digest.hexdigest()
+        filename = content_hash + safe_extension(upload.filename, default_extension)
+        # add() scans the directory for the quota, keep that off the event loop
+        await run_in_threadpool(_place_upload, area, tmp_path, filename)
+        return area.path(filename), content_hash, size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# ---------------- janitor ----------------
+_janitor = None
+
+
+async def _run_janitor(interval: float):
+    while True:
+        for area in AREAS:
+            try:
+                await run_in_threadpool(area.expire)
+            except Exception as e:
+                print(f"⚠️ Storage janitor failed on {area.name}: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_janitor(interval: float = STORAGE_JANITOR_INTERVAL):
+    global _janitor
+    if _janitor is None:
+        _janitor = asyncio.create_task(_run_janitor(interval))
+
+
+async def stop_janitor():
+    global _janitor
+    if _janitor is not None:
+        _janitor.cancel()
+        try:
+            await _janitor
+        except asyncio.CancelledError:
+            pass
+        _janitor = None
+
+
+def storage_stats():
+    """Blocking: scans every area's directory."""
+    return {area.name: area.stats() for area in AREAS}
@@ -0,0 +1,202 @@
+# stt.py
+# Speech-to-text for the voice endpoints.
+#
+# Audio is decoded by ffmpeg straight into 16 kHz mono 16-bit PCM in memory
+# (no temp WAV files), then handed to a pluggable backend:
+#   STT_BACKEND=google  speech_recognition's Google Web Speech API (network call)
+#   STT_BACKEND=vosk    local CPU recognition with Vosk (pip install vosk, VOSK_MODEL_PATH)
+# Backends also expose a streaming recognizer so /voice-stream can recognize
+# audio while it is still being uploaded.
+
+import asyncio
+import json
+import os
+import subprocess
+import time
+from abc import ABC, abstractmethod
+
+STT_BACKEND = os.getenv("STT_BACKEND", "google")
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "models/vosk-model-small-en-us-0.15")
+STT_LANGUAGE = os.getenv("STT_LANGUAGE", "en-US")
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # bytes, s16le
+PCM_READ_SIZE = 8192
+
+_FFMPEG_PCM_ARGS = ["-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+
+
+def decode_to_pcm(file_path: str) -> bytes:
+    """Decode any ffmpeg-readable audio file to 16 kHz mono s16le PCM in memory."""
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-i", file_path, *_FFMPEG_PCM_ARGS],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+
+class PCMDecoder:
+    """
+    Incremental ffmpeg decode: encoded chunks (e.g. MediaRecorder webm) go in
+    with feed(), PCM comes out of read() as soon as ffmpeg produces it.
+    """
+
+    def __init__(self, process):
+        self._process = process
+
+    @classmethod
+    async def start(cls) -> "PCMDecoder":
+        process = await asyncio.create_subprocess_exec(
+            FFMPEG_BINARY, "-loglevel", "error", "-i", "pipe:0", *_FFMPEG_PCM_ARGS,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+        return cls(process)
+
+    async def feed(self, chunk: bytes):
+        self._process.stdin.write(chunk)
+        await self._process.stdin.drain()
+
+    async def end(self):
+        if not self._process.stdin.is_closing():
+            self._process.stdin.close()
+
+    async def read(self) -> bytes:
+        """Next block of PCM; b"" once ffmpeg has finished."""
+        return await self._process.stdout.read(PCM_READ_SIZE)
+
+    async def close(self):
+        await self.end()
+        if self._process.returncode is None:
+            try:
+                self._process.kill()
+            except ProcessLookupError:
+                pass
+        await self._process.wait()
+
+
+class STTBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def transcribe(self, pcm: bytes) -> str:
+        """Transcript of a complete PCM recording."""
+
+    def stream(self) -> "StreamingRecognizer":
+        return BufferedRecognizer(self)
+
+
+class StreamingRecognizer(ABC):
+    @abstractmethod
+    def accept(self, pcm: bytes) -> str:
+        """Feed PCM; returns the current partial transcript ("" if none)."""
+
+    @abstractmethod
+    def finish(self) -> str:
+        """Final transcript, once all audio has been accepted."""
+
+
+class BufferedRecognizer(StreamingRecognizer):
+    """For backends without incremental recognition: collect PCM, transcribe at the end."""
+
+    def __init__(self, backend: STTBackend):
+        self._backend = backend
+        self._chunks = []
+
+    def accept(self, pcm: bytes) -> str:
+        self._chunks.append(pcm)
+        return ""
+
+    def finish(self) -> str:
+        return self._backend.transcribe(b"".join(self._chunks))
+
+
+class GoogleSTT(STTBackend):
+    name = "google"
+
+    def __init__(self):
+        import speech_recognition as sr
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+
+    def transcribe(self, pcm: bytes) -> str:
+        if not pcm:
+            return ""
+        audio = self._sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            return self._recognizer.recognize_google(audio, language=STT_LANGUAGE)
+        except self._sr.UnknownValueError:
+            print("[DEBUG] Speech not recognized")
+            return ""
+        except self._sr.RequestError as e:
+            print(f"[DEBUG] Google API error: {e}")
+            return ""
+
+
+class VoskSTT(STTBackend):
+    name = "vosk"
+
+    def __init__(self, model_path: str = VOSK_MODEL_PATH):
+        import vosk
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self._model = vosk.Model(model_path)  # loaded once, shared by all recognizers
+
+    def transcribe(self, pcm: bytes) -> str:
+        recognizer = self.stream()
+        recognizer.accept(pcm)
+        return recognizer.finish()
+
+    def stream(self) -> "StreamingRecognizer":
+        return _VoskStream(self._vosk.KaldiRecognizer(self._model, SAMPLE_RATE))
+
+
+class _VoskStream(StreamingRecognizer):
+    def __init__(self, recognizer):
+        self._recognizer = recognizer
+        self._final = []  # text of completed utterances
+
+    def accept(self, pcm: bytes) -> str:
+        if self._recognizer.AcceptWaveform(pcm):
+            self._keep(self._recognizer.Result())
+            return " ".join(self._final)
+        partial = json.loads(self._recognizer.PartialResult()).get("partial", "")
+        return " ".join(self._final + ([partial] if partial else []))
+
+    def finish(self) -> str:
+        self._keep(self._recognizer.FinalResult())
+        return " ".join(self._final)
+
+    def _keep(self, result: str):
+        text = json.loads(result).get("text", "")
+        if text:
+            self._final.append(text)
+
+
+_BACKENDS = {"google": GoogleSTT, "vosk": VoskSTT}
+_backend = None
+
+
+def get_backend() -> STTBackend:
+    global _backend
+    if _backend is None:
+        if STT_BACKEND not in _BACKENDS:
+            raise ValueError(f"Unknown STT_BACKEND {STT_BACKEND!r}, expected one of {sorted(_BACKENDS)}")
+        _backend = _BACKENDS[STT_BACKEND]()
+    return _backend
+
+
+def transcribe_file(file_path: str, timings: dict = None) -> str:
+    """Blocking: decode + recognize. Fills timings["convert"] / timings["stt"] (seconds) if given."""
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    pcm = decode_to_pcm(file_path)
+    timings["convert"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    text = get_backend().transcribe(pcm)
+    timings["stt"] = time.perf_counter() - start
+    print(f"[DEBUG] Transcribed text ({get_backend().name}): {text}")
+    return text
@@ -0,0 +1,46 @@
+# Tests run offline and without Postgres:
+# - the chat model is fake_llm's FakeListChatModel (CHAT_LLM=fake),
+# - the sentence-transformers model is replaced by a small deterministic
+#   hashing embedder, so importing utils doesn't download anything,
+# - storage areas (created at import, relative to the working directory) live
+#   in a temporary directory.
+import hashlib
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("CHAT_LLM", "fake")
+os.environ.setdefault("FAKE_LLM_DELAY", "0")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.chdir(tempfile.mkdtemp(prefix="backend-tests-"))
+
+import sentence_transformers  # noqa: E402
+
+EMBEDDING_DIM = 384
+
+
+def embed(text: str) -> np.ndarray:
+    """Unit vector from the text's words: equal texts get equal vectors, no model needed."""
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for word in text.lower().split():
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % EMBEDDING_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class HashingEmbedder:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return embed(texts)
+        return np.stack([embed(t) for t in texts]) if texts else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+
+sentence_transformers.SentenceTransformer = HashingEmbedder
@@ -0,0 +1,80 @@
+import numpy as np
+
+import query_cache
+from conftest import embed
+from query_cache import QueryCache, normalize_query
+from response_cache import ResponseCache
+
+
+# ---------------- query cache ----------------
+def test_normalize_query():
+    assert normalize_query("  Meltdowns?? ") == normalize_query("meltdowns") == "meltdowns"
+    assert normalize_query("What  is\tan IEP?") == "what is an iep"
+
+
+def test_query_cache_lru_eviction():
+    cache = QueryCache(max_entries=2)
+    cache.put_embedding("a", [1])
+    cache.put_embedding("b", [2])
+    cache.get_embedding("a")  # a is now most recent
+    cache.put_embedding("c", [3])
+    assert cache.get_embedding("b") is None
+    assert cache.get_embedding("a") == [1]
+    assert cache.evictions == 1
+
+
+def test_query_cache_ttl(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+    cache = QueryCache(ttl=10)
+    cache.put_embedding("a", [1])
+    now[0] = 11
+    assert cache.get_embedding("a") is None
+
+
+def test_query_cache_results_follow_table_version_but_embedding_survives():
+    cache = QueryCache()
+    cache.put_embedding("q", [1])
+    cache.put_results("q", (10, 100), [(1, "chunk", 0.1)])
+    assert cache.get_results("q", (10, 100)) == [(1, "chunk", 0.1)]
+
+    assert cache.get_results("q", (11, 101)) is None
+    assert cache.invalidations == 1
+    assert cache.get_embedding("q") == [1]
+
+
+def test_query_cache_results_only_entry():
+    cache = QueryCache()
+    cache.put_results("#hybrid||q", 1, [(1, "chunk", 0.5)])
+    assert cache.get_results("#hybrid||q", 1) == [(1, "chunk", 0.5)]
+    assert cache.get_embedding("#hybrid||q") is None
+
+
+# ---------------- response cache ----------------
+def test_response_cache_hit_needs_similar_query_and_same_chunks():
+    cache = ResponseCache(threshold=0.95)
+    cache.store(embed("how do i handle meltdowns"), [1, 2], "reply", latency=2.0)
+
+    assert cache.lookup(embed("how do i handle meltdowns"), [2, 1]) == "reply"
+    assert cache.lookup(embed("how do i handle meltdowns"), [1, 3]) is None
+    assert cache.lookup(embed("best sleep routine for toddlers"), [1, 2]) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["saved_latency_s"]) == (1, 2, 2.0)
+
+
+def test_response_cache_applies_only_to_short_history():
+    cache = ResponseCache(max_history=0)
+    assert cache.applies(0)
+    assert not cache.applies(2)
+    assert cache.stats()["bypassed"] == 1
+
+
+def test_response_cache_bounded():
+    cache = ResponseCache(max_entries=2)
+    for i in range(3):
+        vector = np.zeros(4, dtype=np.float32)
+        vector[i] = 1
+        cache.store(vector, [i], f"reply {i}", latency=1.0)
+    assert cache.stats()["entries"] == 2
+    first = np.array([1, 0, 0, 0], dtype=np.float32)
+    assert cache.lookup(first, [0]) is None
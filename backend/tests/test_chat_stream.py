@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+import agent
+import async_db
+import main
+import retrieval
+from conftest import embed
+from response_cache import ResponseCache
+from session_store import SessionStore
+from tokens import get_current_user
+
+ROWS = [
+    (1, "Predictable routines and advance warning before transitions help many children.", 0.1),
+    (2, "Keep notes on when the behaviour happens and share them with a professional.", 0.2),
+]
+REPLY = "Routines help. Please talk to your child's doctor."
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """A session store that starts empty and never touches Postgres."""
+    store = SessionStore()
+    monkeypatch.setattr(store, "_read", lambda session_id: ([], {}, 0))
+    monkeypatch.setattr(store, "_stale", lambda session_id: False)
+    monkeypatch.setattr(agent, "session_store", store)
+    return store
+
+
+@pytest.fixture
+def chat(monkeypatch, store):
+    async def search_rows(query, timings=None):
+        return list(ROWS)
+
+    async def encode_query(query, key=None):
+        return embed(query)
+
+    monkeypatch.setattr(retrieval, "search_rows", search_rows)
+    monkeypatch.setattr(async_db, "encode_query", encode_query)
+    monkeypatch.setattr(agent, "chat_llm", FakeListChatModel(responses=[REPLY]))
+    monkeypatch.setattr(agent, "response_cache", ResponseCache())
+
+
+@pytest.fixture
+def client(chat):
+    main.app.dependency_overrides[get_current_user] = lambda: 1
+    # not used as a context manager: startup (Postgres pool, models, janitor) doesn't run
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+def test_chat_stream_sends_tokens_then_done(client, store):
+    response = client.post("/chat/stream", json={"session_id": "s1", "question": "How do I handle meltdowns?"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    tokens = [data["token"] for kind, data in events if kind == "message"]
+    assert len(tokens) > 1  # streamed, not one chunk
+    assert "".join(tokens) == REPLY
+    assert events[-1] == ("done", {"session_id": "s1"})
+    assert store.messages("s1") == [
+        {"role": "user", "content": "How do I handle meltdowns?"},
+        {"role": "assistant", "content": REPLY},
+    ]
+
+
+def test_chat_stream_requires_a_token(chat):
+    response = TestClient(main.app).post("/chat/stream", json={"session_id": "s1", "question": "hi"})
+    assert response.status_code == 401
+
+
+def test_stream_agent_saves_nothing_when_consumer_stops_early(chat, store):
+    async def first_token():
+        tokens = agent.stream_agent("s2", "How do I handle meltdowns?")
+        token = await tokens.__anext__()
+        await tokens.aclose()
+        return token
+
+    assert asyncio.run(first_token())
+    assert store.messages("s2") == []
+
+
+def test_stream_agent_reuses_cached_reply_for_fresh_session(chat, store):
+    async def collect(session_id):
+        return "".join([token async for token in agent.stream_agent(session_id, "How do I handle meltdowns?")])
+
+    first = asyncio.run(collect("fresh-1"))
+    agent.chat_llm = FakeListChatModel(responses=["a different answer"])
+    second = asyncio.run(collect("fresh-2"))
+
+    assert second == first == REPLY
+    assert agent.response_cache.stats()["hits"] == 1
+
+
+def test_stream_agent_does_not_cache_answers_built_on_history(chat, store):
+    store.append("s3", "user", "earlier question")
+    store.append("s3", "assistant", "earlier answer")
+
+    async def collect():
+        return "".join([token async for token in agent.stream_agent("s3", "How do I handle meltdowns?")])
+
+    assert asyncio.run(collect()) == REPLY
+    assert agent.response_cache.stats()["entries"] == 0
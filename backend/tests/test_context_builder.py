@@ -0,0 +1,52 @@
+from context_builder import (
+    SUMMARY_LINE_WORDS, build_context, estimate_tokens, fold_into_summary, pack_chunks,
+)
+
+
+def test_pack_chunks_keeps_rank_order_and_skips_chunks_that_dont_fit():
+    chunks = ["a" * 40, "b" * 400, "c" * 40]  # 10, 100, 10 tokens
+    packed, used = pack_chunks(chunks, budget=30)
+    assert packed == ["a" * 40, "c" * 40]
+    assert used == 22  # + one separator token per chunk
+
+
+def test_pack_chunks_cuts_top_chunk_at_sentence_boundary_when_nothing_fits():
+    chunk = "First sentence here. Second sentence here. " + "x" * 400
+    packed, used = pack_chunks([chunk], budget=15)
+    assert packed == ["First sentence here. Second sentence here."]
+    assert used <= 15
+
+
+def test_pack_chunks_empty():
+    assert pack_chunks([], budget=100) == ([], 0)
+
+
+def test_fold_into_summary_condenses_messages():
+    messages = [
+        {"role": "user", "content": "My son has meltdowns. They happen every evening."},
+        {"role": "assistant", "content": " ".join(["word"] * 40) + ". More."},
+    ]
+    summary = fold_into_summary("", messages, budget=1000)
+    lines = summary.splitlines()
+    assert lines[0] == "- user: My son has meltdowns."
+    assert lines[1].endswith("…")
+    assert len(lines[1].split()) == SUMMARY_LINE_WORDS + 3  # "-", "assistant:", words, "…"
+
+
+def test_fold_into_summary_drops_oldest_lines_past_budget():
+    summary = "- user: old line one\n- assistant: old line two"
+    folded = fold_into_summary(summary, [{"role": "user", "content": "newest question"}], budget=10)
+    assert folded.splitlines()[-1] == "- user: newest question"
+    assert "old line one" not in folded
+    assert estimate_tokens(folded) <= 10
+
+
+def test_build_context_stays_within_budget_and_reports_usage():
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "x" * 200}
+                for i in range(20)]
+    built = build_context(["chunk " + "y" * 800] * 5, messages, "", 0, fixed_text="question", budget=600)
+
+    assert built.usage["total"] <= 600
+    assert built.usage["chunks_used"] + built.usage["chunks_dropped"] == 5
+    assert built.summarized > 0  # older messages were folded into the summary
+    assert "message 19" in built.history
@@ -0,0 +1,23 @@
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+from diary import _decode_cursor, _encode_cursor
+
+
+def test_cursor_round_trip():
+    cursor = _encode_cursor({"date": date(2024, 3, 9), "id": 1234})
+    assert _decode_cursor(cursor) == (date(2024, 3, 9), 1234)
+
+
+def test_cursor_is_url_safe():
+    cursor = _encode_cursor({"date": date(2024, 12, 31), "id": 99999999})
+    assert all(c.isalnum() or c in "-_=" for c in cursor)
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "aGVsbG8=", "MjAyNC0xMy0wMXwx"])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        _decode_cursor(cursor)
+    assert excinfo.value.status_code == 400
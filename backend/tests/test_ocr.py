@@ -0,0 +1,17 @@
+from ocr import _coarse_to_fine, merge_lines
+
+
+def test_coarse_to_fine_is_a_permutation():
+    for n in (0, 1, 2, 7, 16, 100):
+        assert sorted(_coarse_to_fine(n)) == list(range(n))
+
+
+def test_coarse_to_fine_starts_in_the_middle_and_spreads_out():
+    order = _coarse_to_fine(16)
+    assert order[:3] == [8, 4, 12]  # middle, then quarters
+    assert sorted(order[:7]) == [2, 4, 6, 8, 10, 12, 14]  # then eighths
+
+
+def test_merge_lines_drops_repeats_across_frames():
+    frames = [["Welcome", "Chapter 1"], ["welcome ", "Chapter  1", "Routines"]]
+    assert merge_lines(frames) == "Welcome\nChapter 1\nRoutines"
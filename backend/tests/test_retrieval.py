@@ -0,0 +1,60 @@
+import pytest
+
+from retrieval import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+@pytest.fixture
+def index():
+    index = BM25Index()
+    index.build(
+        [10, 20, 30, 40],
+        [
+            "An IEP or a 504 plan can give a child with ADHD support at school.",
+            "Meltdowns are common after school; a calm corner can help.",
+            "ADHD medication should be reviewed with a doctor.",
+            "Sleep routines matter for every child.",
+        ],
+        version=(4, 40),
+    )
+    return index
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What is an IEP, and how does it work?") == ["iep", "does", "work"]
+
+
+def test_bm25_ranks_exact_terms_first(index):
+    results = index.search("ADHD IEP 504", k=3)
+    assert [chunk_id for chunk_id, _, _ in results] == [10, 30]
+    assert results[0][2] > results[1][2] > 0
+    assert results[0][1].startswith("An IEP")
+
+
+def test_bm25_respects_k(index):
+    assert len(index.search("child school adhd", k=2)) == 2
+
+
+def test_bm25_no_matching_terms(index):
+    assert index.search("the and of", k=5) == []
+    assert index.search("zebra", k=5) == []
+    assert BM25Index().search("adhd", k=5) == []
+
+
+def test_bm25_rebuild_records_version(index):
+    assert len(index) == 4
+    assert index.version == (4, 40)
+
+
+def test_rrf_prefers_chunks_found_by_both_retrievers():
+    dense = [(1, "a", 0.1), (2, "b", 0.2), (3, "c", 0.3)]
+    sparse = [(3, "c", 9.0), (4, "d", 5.0)]
+    fused = reciprocal_rank_fusion(dense, sparse, k=60)
+
+    assert [chunk_id for chunk_id, _, _ in fused] == [3, 1, 2, 4]
+    assert fused[0][2] == pytest.approx(1 / 63 + 1 / 61)
+    assert fused[1][2] == pytest.approx(1 / 61)
+
+
+def test_rrf_single_ranking_keeps_order():
+    ranking = [(5, "x", 0.0), (6, "y", 0.0)]
+    assert [chunk_id for chunk_id, _, _ in reciprocal_rank_fusion(ranking)] == [5, 6]
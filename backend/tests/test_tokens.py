@@ -0,0 +1,57 @@
+import pytest
+from fastapi import HTTPException
+
+import tokens
+from tokens import BloomFilter, RevocationList, create_access_token, decode_access_token, revoke_token
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(bits=1 << 16, hashes=7)
+    items = [f"jti-{i}" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+    assert bloom.count == 1000
+
+
+def test_bloom_filter_false_positive_rate_is_low():
+    bloom = BloomFilter(bits=1 << 16, hashes=7)
+    for i in range(1000):
+        bloom.add(f"jti-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 50  # expected ~0.0001% at this fill
+
+
+def test_revocation_list_forgets_after_two_periods(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(tokens.time, "monotonic", lambda: now[0])
+    revocations = RevocationList(period=60)
+    revocations.revoke("abc")
+
+    now[0] += 61  # rotated once: still in the previous filter
+    assert revocations.is_revoked("abc")
+    now[0] += 61  # rotated again: the token has expired anyway
+    assert not revocations.is_revoked("abc")
+
+
+def test_access_token_round_trip():
+    token, expires_in = create_access_token(42)
+    claims = decode_access_token(token)
+    assert claims["sub"] == "42"
+    assert expires_in == tokens.ACCESS_TOKEN_TTL
+
+
+def test_tampered_token_is_rejected():
+    token, _ = create_access_token(42)
+    header, payload, signature = token.split(".")
+    with pytest.raises(HTTPException) as excinfo:
+        decode_access_token(f"{header}.{payload}.{signature[::-1]}")
+    assert excinfo.value.status_code == 401
+
+
+def test_revoked_token_is_rejected():
+    token, _ = create_access_token(7)
+    revoke_token(decode_access_token(token))
+    with pytest.raises(HTTPException) as excinfo:
+        decode_access_token(token)
+    assert excinfo.value.detail == "Token has been revoked"
@@ -0,0 +1,153 @@
+# tokens.py
+# Signed, short-lived access tokens (HS256 JWTs via python-jose).
+#
+# - /login issues a token; routes take `Depends(get_current_user)` and get the
+#   user id from the verified token, with no database lookup.
+# - The signing key is constructed once and reused for every sign/verify.
+# - /logout revokes a token by adding its id (jti) to an in-memory bloom
+#   filter. Two filters rotate every ACCESS_TOKEN_TTL seconds, so a revoked
+#   token stays blocked until it has expired anyway and memory stays fixed.
+#   Revocations are per process; with several workers use a shared store.
+
+import hashlib
+import os
+import secrets
+import threading
+import time
+import uuid
+
+from typing import Optional, Tuple
+
+from fastapi import Depends, HTTPException, WebSocket
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwk, jwt
+
+JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", 15 * 60))  # seconds
+REVOCATION_BLOOM_BITS = int(os.getenv("REVOCATION_BLOOM_BITS", 1 << 20))
+REVOCATION_BLOOM_HASHES = 7
+
+_secret = os.getenv("JWT_SECRET")
+if not _secret:
+    print("⚠️ JWT_SECRET is not set; using a random key, tokens won't survive a restart")
+    _secret = secrets.token_urlsafe(32)
+_signing_key = jwk.construct(_secret, JWT_ALGORITHM)
+del _secret
+
+
+class BloomFilter:
+    def __init__(self, bits: int = REVOCATION_BLOOM_BITS, hashes: int = REVOCATION_BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RevocationList:
+    """Current + previous bloom filter, rotated every `period` seconds."""
+
+    def __init__(self, period: float = ACCESS_TOKEN_TTL):
+        self.period = period
+        self._current = BloomFilter()
+        self._previous = BloomFilter()
+        self._rotated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def revoke(self, jti: str):
+        with self._lock:
+            self._rotate()
+            self._current.add(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        with self._lock:
+            self._rotate()
+            return jti in self._current or jti in self._previous
+
+    def stats(self):
+        with self._lock:
+            return {"current": self._current.count, "previous": self._previous.count,
+                    "bits": self._current.bits, "rotation_s": self.period}
+
+    def _rotate(self):
+        now = time.monotonic()
+        if now - self._rotated >= self.period:
+            # a token revoked > 2 periods ago has expired, so both filters can go at once
+            self._previous = self._current if now - self._rotated < 2 * self.period else BloomFilter()
+            self._current = BloomFilter()
+            self._rotated = now
+
+
+revocations = RevocationList()
+_bearer = HTTPBearer(auto_error=False)
+
+
+def create_access_token(user_id: int):
+    """(token, expires_in seconds)."""
+    now = int(time.time())
+    claims = {"sub": str(user_id), "iat": now, "exp": now + ACCESS_TOKEN_TTL, "jti": uuid.uuid4().hex}
+    return jwt.encode(claims, _signing_key, algorithm=JWT_ALGORITHM), ACCESS_TOKEN_TTL
+
+
+def decode_access_token(token: str) -> dict:
+    """Verified claims; raises 401 for a bad, expired or revoked token."""
+    try:
+        claims = jwt.decode(token, _signing_key, algorithms=[JWT_ALGORITHM])
+        int(claims["sub"])
+    except (JWTError, KeyError, ValueError):
+        raise _unauthorized("Invalid or expired token")
+    if revocations.is_revoked(claims.get("jti", "")):
+        raise _unauthorized("Token has been revoked")
+    return claims
+
+
+def revoke_token(claims: dict):
+    revocations.revoke(claims.get("jti", ""))
+
+
+async def get_bearer_token(credentials: HTTPAuthorizationCredentials = Depends(_bearer)) -> str:
+    """FastAPI dependency: the request's bearer token itself (not yet verified), e.g. to forward it."""
+    if credentials is None or credentials.scheme.lower() != "bearer":
+        raise _unauthorized("Not authenticated")
+    return credentials.credentials
+
+
+async def get_token_claims(token: str = Depends(get_bearer_token)) -> dict:
+    return decode_access_token(token)
+
+
+async def get_current_user(claims: dict = Depends(get_token_claims)) -> int:
+    """FastAPI dependency: id of the user the request's bearer token was issued to."""
+    return int(claims["sub"])
+
+
+def websocket_token(websocket: WebSocket) -> Tuple[Optional[str], Optional[str]]:
+    """
+    (token, subprotocol to accept) from a WebSocket handshake. Browsers can't set
+    headers on a WebSocket, so besides an Authorization header the token may come
+    as the subprotocol pair ["bearer", <token>] (then "bearer" is echoed back) or
+    as the `token` query parameter.
+    """
+    protocols = [p.strip() for p in websocket.headers.get("sec-websocket-protocol", "").split(",") if p.strip()]
+    if len(protocols) >= 2 and protocols[0].lower() == "bearer":
+        return protocols[1], protocols[0]
+    scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        return credentials, None
+    return websocket.query_params.get("token"), None
+
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
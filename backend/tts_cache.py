@@ -0,0 +1,134 @@
+# tts_cache.py
+# Content-addressed cache of synthesized replies.
+#
+# - A reply's audio is stored as <sha256(text|voice|lang)>.mp3, so the same text
+#   (canned fallbacks, repeated answers) is synthesized once.
+# - Files live in the storage.tts_audio area, which evicts the least recently
+#   used ones past TTS_CACHE_MAX_BYTES and expires them after TTS_CACHE_TTL.
+# - Audio that isn't cached yet is synthesized sentence by sentence and streamed
+#   as each sentence is ready; the full file is written to the cache at the end.
+# - The reply text is kept next to it as <key>.txt, so whichever worker gets the
+#   audio request can synthesize it.
+
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+
+from storage import StorageArea, tts_audio
+
+TTS_LANG = os.getenv("TTS_LANG", "en")
+TTS_VOICE = os.getenv("TTS_VOICE", "com")  # gTTS `tld`, selects the accent
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_KEY = re.compile(r"^[0-9a-f]{64}$")
+
+
+def cache_key(text: str, voice: str = TTS_VOICE, lang: str = TTS_LANG) -> str:
+    return hashlib.sha256(f"{text}|{voice}|{lang}".encode("utf-8")).hexdigest()
+
+
+def split_sentences(text: str):
+    return [s for s in _SENTENCE_END.split(text.strip()) if s]
+
+
+class TTSCache:
+    def __init__(self, area: StorageArea = tts_audio, voice: str = TTS_VOICE, lang: str = TTS_LANG):
+        self.area = area
+        self.voice = voice
+        self.lang = lang
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.synthesized_chars = 0
+        self.syntheses = 0
+        self.synthesis_seconds = 0.0
+
+    # ---------------- lookups ----------------
+    def key(self, text: str) -> str:
+        return cache_key(text, self.voice, self.lang)
+
+    def cached_path(self, key: str):
+        """Path of the cached file for `key`, or None; counts as a use for LRU."""
+        return self.area.path(key + ".mp3") if self.area.touch(key + ".mp3") else None
+
+    def prepare(self, text: str):
+        """
+        Called when a reply is produced (blocking: small file write). Returns
+        (key, cached). The text is stored in the area so the audio request for
+        `key`, on any worker, can synthesize it if the file isn't (or is no
+        longer) cached by then.
+        """
+        key = self.key(text)
+        cached = self.cached_path(key) is not None
+        if not self.area.touch(key + ".txt"):
+            self.area.write_bytes(key + ".txt", text.encode("utf-8"))
+        with self._lock:
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return key, cached
+
+    def pending_text(self, key: str):
+        """Text of a prepared reply, or None (blocking)."""
+        try:
+            with open(self.area.path(key + ".txt"), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def is_key(name: str) -> bool:
+        return bool(_KEY.match(name))
+
+    # ---------------- synthesis ----------------
+    def synthesize(self, text: str) -> bytes:
+        """Blocking gTTS call for one piece of text."""
+        from gtts import gTTS
+
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=self.lang, tld=self.voice).write_to_fp(buffer)
+        with self._lock:
+            self.synthesized_chars += len(text)
+            self.syntheses += 1
+            self.synthesis_seconds += time.perf_counter() - start
+        return buffer.getvalue()
+
+    def render(self, text: str) -> str:
+        """Blocking: make sure `text` is cached, return the file path."""
+        key = self.key(text)
+        path = self.cached_path(key)
+        if path is None:
+            path = self.store(key, b"".join(self.synthesize(s) for s in split_sentences(text)))
+        return path
+
+    def prerender(self, texts):
+        """Warm the cache with fixed replies; failures (e.g. offline) are only logged."""
+        for text in texts:
+            try:
+                self.render(text)
+            except Exception as e:
+                print(f"⚠️ TTS prerender failed for {text[:40]!r}: {e}")
+
+    def store(self, key: str, audio: bytes) -> str:
+        return self.area.write_bytes(key + ".mp3", audio)
+
+    # ---------------- stats ----------------
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "synthesized_chars": self.synthesized_chars,
+                "syntheses": self.syntheses,
+                # per gTTS call (one sentence, or a whole prerendered reply's sentences one by one)
+                "avg_synthesis_ms": round(self.synthesis_seconds / self.syntheses * 1000, 1) if self.syntheses else 0.0,
+                "synthesis_s": round(self.synthesis_seconds, 2),
+            }
@@ -43,38 +43,76 @@
 #         print(f"{i}. {chunk[:500]}...\n")  # print first 500 chars of each chunk
 
 # utils.py
+import os
 from sentence_transformers import SentenceTransformer
-from db import get_connection
+from db import get_connection, execute_top_k
+import ann_index
+from query_cache import QueryCache, normalize_query
+from embedding_batcher import EmbeddingBatcher
 
 TOP_K = 5  # number of most similar chunks to retrieve
 
+# "sql" → pgvector query in Postgres, "ann" → in-memory index (ann_index.py)
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "sql")
+
 # Load HuggingFace embedding model globally (384-dim)
 embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
 
+# Concurrent single-query encodes are merged into batched forward passes
+embedding_batcher = EmbeddingBatcher(embedding_model)
+
+# Repeated questions skip the encoder and (until the table changes) the search
+query_cache = QueryCache()
+
+EMBEDDINGS_VERSION_SQL = "SELECT count(*), coalesce(max(id), 0) FROM mental_health_embeddings"
+
+def embeddings_version():
+    """Cheap fingerprint of mental_health_embeddings, re-read at most every QUERY_CACHE_VERSION_CHECK seconds."""
+    if query_cache.version_check_due():
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute(EMBEDDINGS_VERSION_SQL)
+            query_cache.set_version(tuple(cur.fetchone()))
+    return query_cache.version
+
+def encode_query(query, key=None):
+    """384-dim query embedding, served from the query cache when possible."""
+    key = key if key is not None else normalize_query(query)
+    vector = query_cache.get_embedding(key)
+    if vector is None:
+        vector = embedding_batcher.encode(key or query)
+        query_cache.put_embedding(key, vector)
+    return vector
+
+def search_vector(query_vector, k=TOP_K):
+    """
+    Nearest chunks to an already-encoded query.
+    Returns a list of (id, content, distance) tuples, nearest first.
+    """
+    if VECTOR_SEARCH_BACKEND == "ann":
+        return ann_index.search(query_vector, k)
+
+    with get_connection() as conn, conn.cursor() as cur:
+        # Postgres vector similarity search (prepared statement, see db.TOP_K_SQL)
+        return execute_top_k(conn, cur, query_vector, k)
+
+def search_rows(query):
+    """TOP_K (id, content, distance) rows for a query, cached per normalized query text."""
+    key = normalize_query(query)
+    version = embeddings_version()
+    rows = query_cache.get_results(key, version)
+    if rows is None:
+        # Encode the query as a 384-dim vector
+        query_vector = encode_query(query, key)
+        rows = search_vector(query_vector)
+        query_cache.put_results(key, version, rows)
+    return rows
+
 def search_similar(query):
     """
     Search for the TOP_K most similar PDF chunks to the query.
     Returns a list of chunk texts.
     """
-    # Encode the query as a 384-dim vector
-    query_vector = embedding_model.encode(query).tolist()
-
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # Postgres vector similarity search (<-> operator)
-    cur.execute(f"""
-        SELECT content, embedding <-> %s::vector AS distance
-        FROM mental_health_embeddings
-        ORDER BY distance
-        LIMIT {TOP_K};
-    """, (query_vector,))
-
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    return [row[0] for row in results]  # only return the text content
+    return [row[1] for row in search_rows(query)]  # only return the text content
 
 
 if __name__ == "__main__":
@@ -1,99 +1,247 @@
+import asyncio
 import os
-import uuid
-from fastapi import APIRouter, UploadFile, Form, HTTPException, Request
-from fastapi.responses import FileResponse, JSONResponse
+import time
+from fastapi import APIRouter, Depends, UploadFile, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.concurrency import run_in_threadpool
-from pydub import AudioSegment
-import speech_recognition as sr
-from gtts import gTTS
+from starlette.websockets import WebSocketState
 import httpx  # Async requests
+from agent import ask_agent_async, NO_INFO_REPLY, ERROR_REPLY
+from storage import save_upload, voice_uploads, MAX_AUDIO_UPLOAD_BYTES
+import stt
+from tokens import decode_access_token, get_bearer_token, get_current_user, websocket_token
+from tts_cache import TTSCache, split_sentences
 
 router = APIRouter(prefix="")
-TEMP_AUDIO_FOLDER = "temp_audio"
-os.makedirs(TEMP_AUDIO_FOLDER, exist_ok=True)
 
-API_BASE = "http://127.0.0.1:8000"  # FastAPI base URL
+# Only set when the chat agent runs in a separate deployment; otherwise the
+# voice path calls the agent in-process.
+VOICE_CHAT_URL = os.getenv("VOICE_CHAT_URL", "").rstrip("/")
+VOICE_CHAT_TIMEOUT = float(os.getenv("VOICE_CHAT_TIMEOUT", 20))
 
+_chat_client = None
 
-def transcribe_audio(file_path: str) -> str:
-    """Convert uploaded audio to text using speech_recognition."""
-    recognizer = sr.Recognizer()
-    
-    # Convert webm → wav safely
-    wav_path = file_path.replace(".webm", f"_{uuid.uuid4().hex}.wav")
-    AudioSegment.from_file(file_path).export(wav_path, format="wav")
 
-    with sr.AudioFile(wav_path) as source:
-        audio_data = recognizer.record(source)
-        try:
-            text = recognizer.recognize_google(audio_data)
-            print(f"[DEBUG] Transcribed text: {text}")
-            return text
-        except sr.UnknownValueError:
-            print("[DEBUG] Speech not recognized")
-            return ""
-        except sr.RequestError as e:
-            print(f"[DEBUG] Google API error: {e}")
-            return ""
+def get_chat_client() -> httpx.AsyncClient:
+    """Shared, connection-pooled client for the remote /chat (VOICE_CHAT_URL)."""
+    global _chat_client
+    if _chat_client is None:
+        _chat_client = httpx.AsyncClient(base_url=VOICE_CHAT_URL, timeout=VOICE_CHAT_TIMEOUT)
+    return _chat_client
+
+
+async def close_chat_client():
+    global _chat_client
+    if _chat_client is not None:
+        await _chat_client.aclose()
+        _chat_client = None
+
+
+UNRECOGNIZED_REPLY = "Sorry, I could not understand your voice."
+NO_REPLY = "I couldn't generate a reply."
+CANNED_REPLIES = [NO_INFO_REPLY, ERROR_REPLY, NO_REPLY]
+
+tts_cache = TTSCache()
+
+
+async def prerender_canned_replies():
+    await run_in_threadpool(tts_cache.prerender, CANNED_REPLIES)
+
+
+def transcribe_audio(file_path: str, timings: dict = None) -> str:
+    """Convert uploaded audio to text (decoded in memory, backend chosen by STT_BACKEND)."""
+    return stt.transcribe_file(file_path, timings)
+
+
+async def get_reply(session_id: str, query_text: str, timings: dict, token: str) -> str:
+    """`token`: the caller's (already verified) access token, forwarded to the remote /chat."""
+    if not VOICE_CHAT_URL:
+        return await ask_agent_async(session_id, query_text, timings)
+
+    start = time.perf_counter()
+    chat_response = await get_chat_client().post(
+        "/chat", json={"session_id": session_id, "question": query_text},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    chat_response.raise_for_status()
+    timings["chat"] = time.perf_counter() - start  # retrieve + llm, not separable remotely
+    return chat_response.json().get("reply", NO_REPLY)
+
+
+async def answer(session_id: str, query_text: str, timings: dict, base_url: str, token: str) -> dict:
+    """Transcript → agent reply → TTS file; the /voice-query response body."""
+    if not query_text:
+        query_text = UNRECOGNIZED_REPLY
+    print(f"[DEBUG] Query text: {query_text}")
+
+    # Ask the agent (in-process, or the remote /chat when VOICE_CHAT_URL is set)
+    reply_text = await get_reply(session_id, query_text, timings, token)
+    print(f"[DEBUG] Reply text: {reply_text}")
+
+    # Reply → speech: served from the TTS cache, or synthesized while /voice-reply streams it
+    key, audio_cached = await run_in_threadpool(tts_cache.prepare, reply_text)
+    tts_filename = f"{key}.mp3"
+
+    # Build URL for frontend
+    audio_url = f"{base_url.rstrip('/')}/voice-reply/{tts_filename}"
+
+    return {
+        "query_text": query_text,
+        "reply_text": reply_text,
+        "audio_file": f"/voice-reply/{tts_filename}",
+        "audio_file_url": audio_url,
+        "audio_cached": audio_cached,
+        "timings_ms": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+    }
 
 
 @router.post("/voice-query")
 async def voice_query(
     audio_file: UploadFile = Form(...),
     session_id: str = Form(...),
-    request: Request = None
+    request: Request = None,
+    user_id: int = Depends(get_current_user),
+    token: str = Depends(get_bearer_token),  # verified by get_current_user; forwarded in remote mode
 ):
+    timings = {}
     try:
-        # Save uploaded audio
-        filename = audio_file.filename or f"{session_id}_{uuid.uuid4().hex}.webm"
-        uploaded_path = os.path.join(TEMP_AUDIO_FOLDER, filename)
-        with open(uploaded_path, "wb") as f:
-            f.write(await audio_file.read())
+        # Save uploaded audio (streamed in chunks, stored as <sha256><ext>)
+        uploaded_path, _, _ = await save_upload(
+            audio_file, voice_uploads, MAX_AUDIO_UPLOAD_BYTES, default_extension=".webm"
+        )
         print(f"[DEBUG] Audio file saved: {uploaded_path}")
 
         # Transcribe audio → text
-        query_text = await run_in_threadpool(transcribe_audio, uploaded_path)
-        if not query_text:
-            query_text = "Sorry, I could not understand your voice."
-        print(f"[DEBUG] Query text: {query_text}")
-
-        # Send text to /chat endpoint asynchronously
-        async with httpx.AsyncClient() as client:
-            chat_response = await client.post(
-                f"{API_BASE}/chat",
-                json={"session_id": session_id, "question": query_text},
-                timeout=20
-            )
-        chat_response.raise_for_status()
-        chat_data = chat_response.json()
-        reply_text = chat_data.get("reply", "I couldn't generate a reply.")
-        print(f"[DEBUG] Reply text: {reply_text}")
-
-        # Convert reply → speech (TTS) with unique filename
-        tts_filename = f"{session_id}_{uuid.uuid4().hex}_reply.mp3"
-        tts_path = os.path.join(TEMP_AUDIO_FOLDER, tts_filename)
-        gTTS(text=reply_text, lang="en").save(tts_path)
-        print(f"[DEBUG] TTS audio saved: {tts_path}")
-
-        # Build URL for frontend
-        base_url = str(request.base_url).rstrip("/")
-        audio_url = f"{base_url}/voice-reply/{tts_filename}"
-
-        return JSONResponse({
-            "query_text": query_text,
-            "reply_text": reply_text,
-            "audio_file": f"/voice-reply/{tts_filename}",
-            "audio_file_url": audio_url,
-        })
+        query_text = await run_in_threadpool(transcribe_audio, uploaded_path, timings)
+        return JSONResponse(await answer(session_id, query_text, timings, str(request.base_url), token))
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] Voice query failed: {e}")
         raise HTTPException(status_code=500, detail=f"Voice query failed: {str(e)}")
 
 
+@router.websocket("/voice-stream")
+async def voice_stream(websocket: WebSocket, session_id: str):
+    """
+    Streaming variant of /voice-query. The client sends encoded audio chunks as
+    binary frames (e.g. MediaRecorder webm) and the text frame "end" when done.
+    Audio is decoded and recognized while it arrives; partial transcripts are
+    sent back as {"partial": ...} and the final message has the same shape as
+    the /voice-query response.
+
+    Authenticated during the handshake (see tokens.websocket_token); without a
+    valid token the connection is refused before any audio is accepted.
+    """
+    token, subprotocol = websocket_token(websocket)
+    try:
+        decode_access_token(token or "")
+    except HTTPException:
+        await websocket.close(code=1008)  # before accept(): the handshake is rejected with 403
+        return
+    await websocket.accept(subprotocol=subprotocol)
+    timings = {}
+    decoder = await stt.PCMDecoder.start()
+    recognizer = stt.get_backend().stream()
+    stt_seconds = 0.0
+
+    async def recognize():
+        nonlocal stt_seconds
+        last_partial = ""
+        while True:
+            pcm = await decoder.read()
+            if not pcm:
+                break
+            start = time.perf_counter()
+            partial = await run_in_threadpool(recognizer.accept, pcm)
+            stt_seconds += time.perf_counter() - start
+            if partial and partial != last_partial:
+                last_partial = partial
+                await websocket.send_json({"partial": partial})
+
+    recognizing = asyncio.create_task(recognize())
+    try:
+        received = 0
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                received += len(message["bytes"])
+                if received > MAX_AUDIO_UPLOAD_BYTES:
+                    await websocket.close(code=1009, reason="Audio too large")
+                    return
+                await decoder.feed(message["bytes"])
+            elif message.get("text") == "end":
+                break
+
+        # stop time: from end of upload to final transcript
+        start = time.perf_counter()
+        await decoder.end()
+        await recognizing
+        query_text = await run_in_threadpool(recognizer.finish)
+        timings["stt_tail"] = time.perf_counter() - start
+        timings["stt"] = stt_seconds
+        print(f"[DEBUG] Streamed transcript ({stt.get_backend().name}): {query_text}")
+
+        base_url = str(websocket.base_url).replace("ws", "http", 1)  # ws:// → http://, wss:// → https://
+        await websocket.send_json(await answer(session_id, query_text, timings, base_url, token))
+        await websocket.close()
+    except WebSocketDisconnect:
+        print("[DEBUG] Voice stream client disconnected")
+    except Exception as e:
+        print(f"[ERROR] Voice stream failed: {e}")
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close(code=1011, reason="Voice query failed")
+    finally:
+        recognizing.cancel()
+        await decoder.close()
+
+
+# keys being synthesized by this process → set once the stream ends (cached or not).
+# A waiter gives up after TTS_FETCH_WAIT seconds (e.g. a response whose body was never
+# started, so its cleanup never ran) and synthesizes the reply itself.
+_synthesizing = {}
+TTS_FETCH_WAIT = float(os.getenv("TTS_FETCH_WAIT", 30))
+
+
+async def stream_tts(key: str, text: str, done: asyncio.Event):
+    """Yield MP3 audio sentence by sentence; the whole reply is cached once complete."""
+    parts = []
+    start = time.perf_counter()
+    try:
+        for sentence in split_sentences(text):
+            audio = await run_in_threadpool(tts_cache.synthesize, sentence)
+            parts.append(audio)
+            yield audio
+        await run_in_threadpool(tts_cache.store, key, b"".join(parts))
+        print(f"[DEBUG] TTS streamed and cached in {time.perf_counter() - start:.2f}s: {key}")
+    finally:
+        _synthesizing.pop(key, None)
+        done.set()
+
+
 @router.get("/voice-reply/{filename}")
 async def get_voice_file(filename: str):
-    file_path = os.path.join(TEMP_AUDIO_FOLDER, filename)
-    if not os.path.exists(file_path):
+    key, ext = os.path.splitext(filename)
+    if ext != ".mp3" or not tts_cache.is_key(key):
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    # a concurrent fetch of the same reply waits for the one synthesizing it, then gets the file
+    in_progress = _synthesizing.get(key)
+    if in_progress is not None:
+        try:
+            await asyncio.wait_for(in_progress.wait(), TTS_FETCH_WAIT)
+        except asyncio.TimeoutError:
+            if _synthesizing.get(key) is in_progress:
+                del _synthesizing[key]
+    file_path = tts_cache.cached_path(key)
+    if file_path is not None:
+        return FileResponse(file_path, media_type="audio/mpeg", filename=filename)
+    text = await run_in_threadpool(tts_cache.pending_text, key)
+    if text is None:
         raise HTTPException(status_code=404, detail="Audio file not found")
-    return FileResponse(file_path, media_type="audio/mpeg", filename=filename)
+    if key in _synthesizing:  # another fetch started while we read the text
+        return await get_voice_file(filename)
+    done = _synthesizing[key] = asyncio.Event()
+    return StreamingResponse(stream_tts(key, text, done), media_type="audio/mpeg")